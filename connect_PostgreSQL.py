@@ -1,9 +1,12 @@
 # PostgreSQL データベース接続設定
+import asyncio
+import functools
 import os
+import orjson
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.ext.declarative import declarative_base
 import logging
 
 logger = logging.getLogger(__name__)
@@ -21,19 +24,44 @@ DB_NAME = os.getenv('DB_NAME')#, 'idea_spark')
 # PostgreSQL接続URL
 DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
+def json_dumps(value) -> str:
+    """JSON/JSONB列の書き込み用シリアライザ（標準jsonより高速なorjsonを使用）"""
+    return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode()
+
+# コネクションプールのサイズ（ワーカー1プロセスあたり。最大接続数は pool_size + max_overflow）
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "15"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+
 # SQLAlchemyエンジンの作成
+# echo=TrueだとSQL文とパラメータを毎回ログ出力するため、必要な時だけ DB_ECHO=true で有効化する
 engine = create_engine(
     DATABASE_URL,
-    echo=True,
+    echo=os.getenv("DB_ECHO", "false").lower() in ("1", "true", "yes"),
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
     pool_pre_ping=True,
     pool_recycle=3600,
+    # JSON/JSONB列の変換にorjsonを使う（raw_connection()で取得した接続の読み出しにも適用される）
+    json_serializer=json_dumps,
+    json_deserializer=orjson.loads,
 )
 
 # セッションメーカーの作成
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-# ベースクラスの作成
-# Base = declarative_base()
+# 非同期エンドポイントから同期DB処理を呼ぶための専用スレッドプール
+# （FastAPIの同期エンドポイント用スレッドプールと分け、DBコネクションプールと同程度の並列数に抑える）
+_db_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("DB_THREAD_POOL_SIZE", "10")),
+    thread_name_prefix="db",
+)
+
+async def run_db(func, *args, **kwargs):
+    """同期DB関数を専用スレッドプールで実行し、イベントループをブロックしない"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, functools.partial(func, *args, **kwargs))
 
 def get_db():
     """データベースセッションの取得"""
@@ -42,20 +70,68 @@ def get_db():
         yield session
     except Exception as e:
         session.rollback()
-        logger.error(f"データベースエラー: {e}")
+        logger.error("データベースエラー: %s", e)
         raise
     finally:
         session.close()
 
+def close_db():
+    """終了時にDB用スレッドプールを止め、プール内の接続をすべて閉じる"""
+    _db_executor.shutdown(wait=True)
+    engine.dispose()
+
+def get_pool_status() -> dict:
+    """コネクションプールの使用状況を取得（プールサイズ調整用）"""
+    pool = engine.pool
+    return {
+        "pool_size": pool.size(),
+        "max_overflow": DB_MAX_OVERFLOW,
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "db_thread_pool_size": _db_executor._max_workers,
+    }
+
+def check_pool_capacity():
+    """プールの最大接続数がPostgreSQLのmax_connectionsに対して大きすぎないか確認（起動時）"""
+    try:
+        with engine.connect() as conn:
+            max_connections = int(conn.execute(text("SHOW max_connections")).scalar())
+        workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+        pool_max = DB_POOL_SIZE + DB_MAX_OVERFLOW
+        if pool_max * workers > max_connections:
+            logger.warning(
+                "DBプールの最大接続数(%d × %dワーカー)がmax_connections(%d)を超えています",
+                pool_max, workers, max_connections
+            )
+    except Exception as e:
+        logger.warning("max_connectionsの確認をスキップしました: %s", e)
+
+def warm_up_pool():
+    """起動時にプールの接続を事前に確立しておき、最初のリクエストが接続確立の待ち時間を負担しないようにする"""
+    size = min(int(os.getenv("DB_POOL_WARMUP", str(DB_POOL_SIZE))), DB_POOL_SIZE)
+    connections = []
+    try:
+        # 同時にチェックアウトしないと同じ接続が使い回されるため、全て確保してからまとめて返却する
+        for _ in range(size):
+            conn = engine.connect()
+            connections.append(conn)
+            conn.execute(text("SELECT 1"))
+        logger.info("DBコネクションプールを%d接続でウォームアップしました", len(connections))
+    except Exception as e:
+        logger.warning("DBコネクションプールのウォームアップに失敗しました: %s", e)
+    finally:
+        for conn in connections:
+            conn.close()
+
 def test_database_connection():
     """データベース接続テスト"""
     try:
-        session = SessionLocal()
-        session.execute("SELECT 1")
-        session.close()
+        with SessionLocal() as session:
+            session.execute(text("SELECT 1"))
         logger.info("データベース接続成功")
         return {"status": "healthy", "message": "データベース接続成功"}
     except Exception as e:
-        logger.error(f"データベース接続エラー: {e}")
+        logger.error("データベース接続エラー: %s", e)
         return {"status": "unhealthy", "message": f"データベース接続エラー: {e}"}
 
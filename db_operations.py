@@ -1,21 +1,34 @@
 # CRUD操作とモデル定義
-from sqlalchemy import Column, Integer, Text, VARCHAR, DateTime, Date, Boolean, JSON, ForeignKey
+from sqlalchemy import Column, Integer, Text, VARCHAR, DateTime, Date, Boolean, JSON, ForeignKey, Index
 from sqlalchemy import Enum as SQLEnum
-from sqlalchemy import select, insert, update, delete
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy import select, insert, update, delete, text, bindparam, tuple_
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import DeclarativeBase, relationship, Mapped, mapped_column
 from sqlalchemy.sql import func
 from connect_PostgreSQL import SessionLocal, engine
-from pydantic import BaseModel, EmailStr, Field, computed_field
+from services.cache_service import TTLCache
+from pydantic import BaseModel, ConfigDict, EmailStr, Field, computed_field
 from datetime import datetime, timezone, timedelta, date
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Iterator
 from enum import Enum
 import bcrypt
 import secrets
 import logging
+import os
 
 
 logger = logging.getLogger(__name__)
 
+# 参照頻度が高く更新が少ないデータのプロセス内キャッシュ（更新・削除時に無効化）
+_project_cache = TTLCache(maxsize=10_000, ttl=float(os.getenv("PROJECT_CACHE_TTL_SECONDS", "30")))
+_user_cache = TTLCache(maxsize=10_000, ttl=float(os.getenv("USER_CACHE_TTL_SECONDS", "60")))
+# session_id → (user_id, expires_at)。ログアウト時に無効化する
+# ログアウトで消えるのはそのプロセスのキャッシュだけで、他のワーカーでは最大TTL秒の間
+# ログアウト済みのセッションが通るため、TTLは数秒に留める（複数ワーカーでログアウトを即時に
+# 反映させる必要がある場合は SESSION_CACHE_TTL_SECONDS=0 でキャッシュを無効化する）
+_session_cache = TTLCache(maxsize=10_000, ttl=float(os.getenv("SESSION_CACHE_TTL_SECONDS", "2")))
+
 # === SQLAlchemyモデル ===
 class UpdateCategory(Enum):
     manual = 'manual'
@@ -63,7 +76,8 @@ class Session(Base):
     session_id: Mapped[str] = mapped_column(VARCHAR(255), primary_key=True)
     user_id: Mapped[int] = mapped_column(Integer, ForeignKey('users.user_id'), nullable=False)
     created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), nullable=False)
-    expires_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow() + timedelta(days=1), nullable=False)
+    # 既定値はINSERT時点から1日後（モジュール読み込み時に固定されないよう関数で渡す）
+    expires_at: Mapped[datetime] = mapped_column(DateTime, default=lambda: datetime.utcnow() + timedelta(days=1), nullable=False)
     is_active: Mapped[bool] = mapped_column(Boolean, default=True, nullable=False)
 
     user = relationship("User", backref="sessions")
@@ -71,6 +85,10 @@ class Session(Base):
 class Project(Base):
     """プロジェクトテーブル"""
     __tablename__ = 'projects'
+    __table_args__ = (
+        # ユーザーのプロジェクト一覧（user_idで絞り込み）
+        Index('ix_projects_user_id', 'user_id'),
+    )
 
     project_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(Integer, ForeignKey('users.user_id'), nullable=False)
@@ -82,6 +100,10 @@ class Project(Base):
 class EditHistory(Base):
     """編集履歴テーブル"""
     __tablename__ = 'edit_history'
+    # プロジェクトごとの最新版取得（ORDER BY last_updated DESC LIMIT 1）用
+    __table_args__ = (
+        Index('ix_edit_history_project_id_last_updated', 'project_id', 'last_updated'),
+    )
     
     edit_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     project_id: Mapped[int] = mapped_column(Integer, ForeignKey('projects.project_id'), nullable=False)
@@ -118,6 +140,10 @@ class ProjectMember(Base):
 class ResearchResult(Base):
     """リサーチ結果"""
     __tablename__ = 'research_results'
+    __table_args__ = (
+        # 編集履歴ごとのリサーチ結果取得・削除と、researched_at順の並べ替え
+        Index('ix_research_results_edit_id_researched_at', 'edit_id', 'researched_at'),
+    )
 
     research_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     edit_id: Mapped[int] = mapped_column(Integer, ForeignKey('edit_history.edit_id'), nullable=False)
@@ -131,6 +157,12 @@ class ResearchResult(Base):
 class InterviewNote(Base):
     """インタビュー結果"""
     __tablename__ = 'interview_notes'
+    __table_args__ = (
+        # プロジェクトごとのインタビューメモ一覧
+        Index('ix_interview_notes_project_id_interview_date', 'project_id', 'interview_date', 'created_at'),
+        # 編集履歴削除時のON DELETE CASCADEで全件走査にならないように
+        Index('ix_interview_notes_edit_id', 'edit_id'),
+    )
 
     note_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     edit_id: Mapped[Optional[int]] = mapped_column(Integer, ForeignKey('edit_history.edit_id', ondelete="CASCADE"), nullable=True)
@@ -149,6 +181,13 @@ class InterviewNote(Base):
 class Document(Base):
     """投稿資料の情報"""
     __tablename__ = 'documents'
+    __table_args__ = (
+        # 文書一覧（project_idで絞り込み、uploaded_at降順）をソートなしのインデックス走査で返す
+        Index(
+            'ix_documents_project_id_uploaded_at', 'project_id', 'uploaded_at',
+            postgresql_include=['file_name', 'file_type', 'file_size', 'source_type', 'user_id']
+        ),
+    )
 
     document_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(Integer, ForeignKey('users.user_id'), nullable=False)
@@ -165,6 +204,8 @@ class Document(Base):
         nullable=False,
         server_default='pending',
     )
+    # RAG処理を受け付けたプロセスが定期的に更新する生存確認時刻（未設定の間は uploaded_at で判定）
+    processing_heartbeat: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
 
     user = relationship("User", backref="documents")
     project = relationship("Project", backref="documents")
@@ -183,6 +224,9 @@ class UserLogin(BaseModel):
 
 class UserResponse(BaseModel):
     """ユーザー情報レスポンスモデル"""
+    # 返却専用の値オブジェクト（生成後に変更しない）
+    model_config = ConfigDict(frozen=True)
+
     user_id: int
     email: str
     created_at: datetime
@@ -190,12 +234,16 @@ class UserResponse(BaseModel):
 
 class ProjectResponse(BaseModel):
     """プロジェクトレスポンスモデル"""
+    model_config = ConfigDict(frozen=True)
+
     project_id: int
     project_name: str
     created_at: datetime
 
 class AuthResponse(BaseModel):
     """認証レスポンスモデル"""
+    model_config = ConfigDict(frozen=True)
+
     message: str
     user: Optional[UserResponse] = None
 
@@ -252,34 +300,26 @@ def create_user(email: str, password: str) -> Dict[str, Any]:
         if len(password) < 8:
             return {"success": False, "message": "パスワードは8文字以上で入力してください"}
         
-        # 既存ユーザーチェック
-        existing_user = db.query(User).filter(User.email == email).first()
-        if existing_user:
-            return {"success": False, "message": "このメールアドレスは既に登録されています"}
-        
         # パスワードハッシュ化
         hashed_pw = hash_password(password)
         
-        # 新規ユーザー作成
-        new_user = User(
-            email=email,
-            hashed_pw=hashed_pw
-        )
-        
-        db.add(new_user)
-        db.commit()
-        db.refresh(new_user)
+        # 新規ユーザー作成（重複チェックは事前SELECTではなくemailの一意制約で行う）
+        query = insert(User).values(email=email, hashed_pw=hashed_pw).returning(User.user_id)
+        with db.begin():
+            user_id = db.execute(query).scalar_one()
         
-        logger.info(f"新規ユーザー作成成功: {email}")
+        logger.info("新規ユーザー作成成功: %s", email)
         return {
             "success": True,
             "message": "ユーザー登録が完了しました",
-            "user_id": new_user.user_id
+            "user_id": user_id
         }
         
+    except IntegrityError:
+        return {"success": False, "message": "このメールアドレスは既に登録されています"}
     except Exception as e:
         db.rollback()
-        logger.error(f"ユーザー作成エラー: {e}")
+        logger.error("ユーザー作成エラー: %s", e)
         return {"success": False, "message": "ユーザー作成に失敗しました"}
     finally:
         db.close()
@@ -288,8 +328,11 @@ def authenticate_user(email: str, password: str) -> Dict[str, Any]:
     """ユーザー認証"""
     db = SessionLocal()
     try:
-        # ユーザー取得
-        user = db.query(User).filter(User.email == email).first()
+        # ユーザー取得（トランザクションを終えて接続をプールへ返してから、時間のかかるbcrypt検証を行う）
+        with db.begin():
+            user = db.execute(
+                select(User.user_id, User.email, User.hashed_pw).where(User.email == email)
+            ).first()
         if not user:
             return {"success": False, "message": "メールアドレスが正しくありません"}
         
@@ -298,10 +341,11 @@ def authenticate_user(email: str, password: str) -> Dict[str, Any]:
             return {"success": False, "message": "パスワードが正しくありません"}
         
         # 最終ログイン時刻更新
-        user.last_login = func.now()
-        db.commit()
+        with db.begin():
+            db.execute(update(User).where(User.user_id == user.user_id).values(last_login=func.now()))
+        _user_cache.pop(user.user_id)
         
-        logger.info(f"ユーザー認証成功: {email}")
+        logger.info("ユーザー認証成功: %s", email)
         return {
             "success": True,
             "message": "認証成功",
@@ -311,11 +355,18 @@ def authenticate_user(email: str, password: str) -> Dict[str, Any]:
         
     except Exception as e:
         db.rollback()
-        logger.error(f"認証エラー: {e}")
+        logger.error("認証エラー: %s", e)
         return {"success": False, "message": "認証に失敗しました"}
     finally:
         db.close()
 
+# セッションの有効期間
+_SESSION_LIFETIME = timedelta(hours=24)
+
+def _utc_now():
+    """DBの現在時刻（UTC、タイムゾーンなし。sessions.expires_atと同じ形式）"""
+    return func.timezone('UTC', func.now())
+
 def create_session(user_id: int) -> Optional[str]:
     """セッション作成"""
     db = SessionLocal()
@@ -323,65 +374,97 @@ def create_session(user_id: int) -> Optional[str]:
         # セッションID生成
         session_id = secrets.token_urlsafe(32)
         
-        # セッション作成（24時間有効）
-        from datetime import timedelta
-        expires_at = datetime.utcnow() + timedelta(hours=24)
-        
-        new_session = Session(
+        # セッション作成（24時間有効。有効期限はDBの時計（UTC）で計算する）
+        query = insert(Session).values(
             session_id=session_id,
             user_id=user_id,
-            expires_at=expires_at
+            expires_at=_utc_now() + _SESSION_LIFETIME
         )
+        with db.begin():
+            db.execute(query)
         
-        db.add(new_session)
-        db.commit()
-        
-        logger.info(f"セッション作成成功: user_id={user_id}")
+        logger.info("セッション作成成功: user_id=%s", user_id)
         return session_id
         
     except Exception as e:
         db.rollback()
-        logger.error(f"セッション作成エラー: {e}")
+        logger.error("セッション作成エラー: %s", e)
         return None
     finally:
         db.close()
 
+# 認証付きリクエストごとに実行されるため、文はモジュール読み込み時に一度だけ組み立てる
+_VALIDATE_SESSION_QUERY = select(Session.user_id, Session.expires_at).where(
+    Session.session_id == bindparam("session_id"),
+    Session.is_active == True,
+    Session.expires_at > _utc_now()
+)
+
 def validate_session(session_id: str) -> Optional[int]:
-    """セッション検証"""
+    """セッション検証（有効なセッションは短時間キャッシュし、リクエストごとのSELECTを省く）"""
+    cached = _session_cache.get(session_id)
+    if cached is not None:
+        user_id, expires_at = cached
+        # expires_atはUTC（タイムゾーンなし）で保存されている
+        if expires_at > datetime.utcnow():
+            return user_id
+        _session_cache.pop(session_id)
+        return None
+
     db = SessionLocal()
     try:
-        session = db.query(Session).filter(
-            Session.session_id == session_id,
-            Session.is_active == True,
-            Session.expires_at > datetime.utcnow()
-        ).first()
-        
-        if session:
-            return session.user_id
-        return None
+        row = db.execute(_VALIDATE_SESSION_QUERY, {"session_id": session_id}).first()
+        if row is None:
+            return None
+        _session_cache.set(session_id, (row.user_id, row.expires_at))
+        return row.user_id
         
     except Exception as e:
-        logger.error(f"セッション検証エラー: {e}")
+        logger.error("セッション検証エラー: %s", e)
         return None
     finally:
         db.close()
 
+def invalidate_session(session_id: str) -> bool:
+    """セッションを無効化（ログアウト）"""
+    _session_cache.pop(session_id)
+    db = SessionLocal()
+    try:
+        with db.begin():
+            db.execute(
+                update(Session).where(Session.session_id == session_id).values(is_active=False)
+            )
+        return True
+    except Exception as e:
+        logger.error("セッション無効化エラー: %s", e)
+        return False
+    finally:
+        # 無効化と並行して検証したリクエストが再びキャッシュしていた場合に備えて、もう一度消す
+        _session_cache.pop(session_id)
+        db.close()
+
 def get_user_by_id(user_id: int) -> Optional[Dict[str, Any]]:
     """ユーザー情報取得"""
+    cached = _user_cache.get(user_id)
+    if cached is not None:
+        return dict(cached)
+
     db = SessionLocal()
     try:
         user = db.query(User).filter(User.user_id == user_id).first()
         if user:
-            return {
+            user_info = {
                 "user_id": user.user_id,
                 "email": user.email,
                 "created_at": user.created_at,
                 "last_login": user.last_login
             }
+            _user_cache.set(user_id, user_info)
+            return dict(user_info)
         return None
         
     except Exception as e:
-        logger.error(f"ユーザー取得エラー: {e}")
+        logger.error("ユーザー取得エラー: %s", e)
         return None
     finally:
         db.close()
@@ -390,42 +473,44 @@ def get_user_projects(user_id: int) -> List[Dict[str, Any]]:
     """ユーザーのプロジェクト一覧取得"""
     db = SessionLocal()
     try:
-        projects = db.query(Project).filter(
+        # 一覧に必要な列だけを取得し、ORMエンティティを組み立てない
+        rows = db.query(
+            Project.project_id, Project.project_name, Project.created_at
+        ).filter(
             Project.user_id == user_id
         ).all()
         
-        return [
-            {
-                "project_id": project.project_id,
-                "project_name": project.project_name,
-                "created_at": project.created_at
-            }
-            for project in projects
-        ]
+        return [row._asdict() for row in rows]
         
     except Exception as e:
-        logger.error(f"プロジェクト取得エラー: {e}")
+        logger.error("プロジェクト取得エラー: %s", e)
         return []
     finally:
         db.close()
 
 def get_project_by_id(project_id: int) -> Optional[Dict[str, Any]]:
     """指定されたプロジェクトIDのプロジェクト情報を取得"""
+    cached = _project_cache.get(project_id)
+    if cached is not None:
+        return dict(cached)
+
     db = SessionLocal()
     try:
         project = db.query(Project).filter(Project.project_id == project_id).first()
         
         if project:
-            return {
+            project_info = {
                 "project_id": project.project_id,
                 "project_name": project.project_name,
                 "user_id": project.user_id,
                 "created_at": project.created_at
             }
+            _project_cache.set(project_id, project_info)
+            return dict(project_info)
         return None
         
     except Exception as e:
-        logger.error(f"プロジェクト取得エラー: {e}")
+        logger.error("プロジェクト取得エラー: %s", e)
         return None
     finally:
         db.close()
@@ -434,26 +519,169 @@ def get_project_by_id(project_id: int) -> Optional[Dict[str, Any]]:
 def create_tables():
     """テーブル作成"""
     Base.metadata.create_all(bind=engine)
+    _ensure_indexes()
+    _ensure_vector_index()
+    _ensure_jsonb_metadata()
+    _ensure_document_heartbeat()
     logger.info("テーブル作成完了")
 
+def _ensure_indexes():
+    """既存テーブルに後から追加したインデックスを作成（create_allは既存テーブルのインデックスを作らないため）"""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(bind=engine, checkfirst=True)
+            except Exception as e:
+                logger.warning("インデックス作成をスキップしました: %s: %s", index.name, e)
+
+# 埋め込みモデルごとの既定の次元数（OPENAI_EMBEDDING_DIMENSIONS 未設定時に使う）
+_EMBEDDING_MODEL_DIMENSIONS = {
+    "text-embedding-3-large": 3072,
+    "text-embedding-3-small": 1536,
+    "text-embedding-ada-002": 1536,
+}
+
+def get_embedding_dimensions() -> int:
+    """保存・検索に使う埋め込みベクトルの次元数（OPENAI_EMBEDDING_DIMENSIONS、未設定ならモデルの既定値）"""
+    configured = os.getenv("OPENAI_EMBEDDING_DIMENSIONS")
+    if configured:
+        return int(configured)
+    model = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-large")
+    if model not in _EMBEDDING_MODEL_DIMENSIONS:
+        raise ValueError(f"埋め込みモデル {model} の次元数が不明です。OPENAI_EMBEDDING_DIMENSIONSを設定してください")
+    return _EMBEDDING_MODEL_DIMENSIONS[model]
+
+def _check_embedding_dimensions(dimensions: int):
+    """保存済みチャンクの次元数が設定と一致するか確認（一致しない場合は検索が全て失敗するため起動を止める）"""
+    query = text(
+        "SELECT vector_dims(embedding::vector) FROM document_chunks WHERE embedding IS NOT NULL LIMIT 1"
+    )
+    try:
+        with engine.begin() as conn:
+            stored = conn.execute(query).scalar()
+    except Exception as e:
+        logger.warning("保存済み埋め込みの次元数確認をスキップしました: %s", e)
+        return
+    if stored is not None and stored != dimensions:
+        raise RuntimeError(
+            f"保存済みの埋め込みは{stored}次元ですが、設定は{dimensions}次元です"
+            "（OPENAI_EMBEDDING_MODEL / OPENAI_EMBEDDING_DIMENSIONS を確認するか、既存チャンクを再処理してください）"
+        )
+
+def _ensure_vector_index():
+    """document_chunks.embedding のHNSWインデックスを作成
+
+    HNSWはvector型で2000次元までのため、3072次元のtext-embedding-3-largeでも使えるよう
+    halfvec（FP16）へのキャスト式でインデックスを張る（pgvector 0.7以上が必要）。
+    """
+    dimensions = get_embedding_dimensions()
+    _check_embedding_dimensions(dimensions)
+    statement = text(
+        "CREATE INDEX IF NOT EXISTS ix_document_chunks_embedding_hnsw "
+        f"ON document_chunks USING hnsw ((embedding::halfvec({dimensions})) halfvec_cosine_ops) "
+        "WITH (m = 16, ef_construction = 64)"
+    )
+    try:
+        with engine.begin() as conn:
+            conn.execute(statement)
+    except Exception as e:
+        logger.warning("ベクトルインデックス作成をスキップしました: %s", e)
 
-def get_latest_edit_id(project_id: int) -> Optional[int]:
-    """指定されたプロジェクトの最新のedit_idを取得"""
-    db = SessionLocal()
-    query = select(EditHistory).filter(
+    # 2段階検索（VECTOR_BINARY_PRERANK）用：バイナリ量子化ベクトルのハミング距離インデックス
+    if os.getenv("VECTOR_BINARY_PRERANK", "false").lower() in ("1", "true", "yes"):
+        binary_statement = text(
+            "CREATE INDEX IF NOT EXISTS ix_document_chunks_embedding_binary_hnsw "
+            f"ON document_chunks USING hnsw ((binary_quantize(embedding::halfvec({dimensions}))::bit({dimensions})) bit_hamming_ops)"
+        )
+        try:
+            with engine.begin() as conn:
+                conn.execute(binary_statement)
+        except Exception as e:
+            logger.warning("バイナリ量子化インデックス作成をスキップしました: %s", e)
+
+def _ensure_jsonb_metadata():
+    """既存のdocument_chunks.chunk_metadataがjson型の場合はjsonb型へ変換（create_allは既存列の型を変えないため）"""
+    check = text(
+        "SELECT data_type FROM information_schema.columns "
+        "WHERE table_name = 'document_chunks' AND column_name = 'chunk_metadata'"
+    )
+    try:
+        with engine.begin() as conn:
+            if conn.execute(check).scalar() == "json":
+                conn.execute(text(
+                    "ALTER TABLE document_chunks ALTER COLUMN chunk_metadata TYPE jsonb USING chunk_metadata::jsonb"
+                ))
+                logger.info("document_chunks.chunk_metadata をjsonb型に変換しました")
+    except Exception as e:
+        logger.warning("chunk_metadataのjsonb変換をスキップしました: %s", e)
+
+def _ensure_document_heartbeat():
+    """既存のdocumentsテーブルにprocessing_heartbeat列を追加（create_allは既存テーブルに列を追加しないため）"""
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE documents ADD COLUMN IF NOT EXISTS processing_heartbeat TIMESTAMP"))
+    except Exception as e:
+        logger.warning("documents.processing_heartbeatの追加をスキップしました: %s", e)
+
+
+def get_latest_canvas_details(project_id: int) -> Optional[Dict[str, Any]]:
+    """指定されたプロジェクトの最新キャンバス詳細を1クエリで取得（戻り値はget_canvas_detailsと同じ {edit_id: field} 形式）"""
+    query = select(Detail.edit_id, Detail.field).join(
+        EditHistory, EditHistory.edit_id == Detail.edit_id
+    ).filter(
         EditHistory.project_id == project_id
-            ).order_by(EditHistory.last_updated.desc()).limit(1)
+    ).order_by(EditHistory.last_updated.desc()).limit(1)
 
+    db = SessionLocal()
     try:
-        with db.begin():
-            result = db.execute(query).scalar_one_or_none()
-            if result:
-                return result.edit_id
+        row = db.execute(query).first()
+        if not row:
             return None
+        return {row.edit_id: row.field}
         
     except Exception as e:
-        logger.error(f"最新のedit_id取得エラー: {e}")
+        logger.error("最新キャンバス詳細取得エラー: %s", e)
         return None
+    finally:
+        db.close()
+
+def get_project_with_latest_canvas(project_id: int) -> Optional[Dict[str, Any]]:
+    """プロジェクト情報と最新キャンバス詳細を1クエリで取得
+
+    戻り値: {"project": get_project_by_idと同じ形式, "canvas_details": {edit_id: field} または None}
+    プロジェクトが存在しない場合はNone
+    """
+    latest_edit_id = select(EditHistory.edit_id).where(
+        EditHistory.project_id == Project.project_id
+    ).order_by(EditHistory.last_updated.desc()).limit(1).correlate(Project).scalar_subquery()
+
+    query = select(
+        Project.project_id, Project.project_name, Project.user_id, Project.created_at,
+        Detail.edit_id, Detail.field
+    ).outerjoin(
+        Detail, Detail.edit_id == latest_edit_id
+    ).where(Project.project_id == project_id)
+
+    db = SessionLocal()
+    try:
+        row = db.execute(query).first()
+        if not row:
+            return None
+        return {
+            "project": {
+                "project_id": row.project_id,
+                "project_name": row.project_name,
+                "user_id": row.user_id,
+                "created_at": row.created_at
+            },
+            "canvas_details": {row.edit_id: row.field} if row.edit_id is not None else None
+        }
+        
+    except Exception as e:
+        logger.error("プロジェクト・最新キャンバス取得エラー: %s", e)
+        return None
+    finally:
+        db.close()
 
 def get_canvas_details(edit_id: int) -> Optional[Dict[str, Any]]:
     """指定されたedit_idのキャンバス詳細を取得"""
@@ -470,8 +698,10 @@ def get_canvas_details(edit_id: int) -> Optional[Dict[str, Any]]:
             return details
         
     except Exception as e:
-        logger.error(f"キャンバス詳細取得エラー: {e}")
+        logger.error("キャンバス詳細取得エラー: %s", e)
         return None
+    finally:
+        db.close()
     
 def insert_project(value):
     """プロジェクトを挿入"""
@@ -481,98 +711,89 @@ def insert_project(value):
         with db.begin():
             result = db.execute(query)
             project_id = result.inserted_primary_key[0]
-            logger.info(f"プロジェクト挿入成功: project_id={project_id}")
+            logger.info("プロジェクト挿入成功: project_id=%s", project_id)
             return project_id
     except Exception as e:
         db.rollback()
-        logger.error(f"プロジェクト挿入エラー: {e}")
+        logger.error("プロジェクト挿入エラー: %s", e)
         return None
     finally:
         db.close()
 
-def insert_edit_history(project_id: int, version: int, user_id: int, update_category: UpdateCategory, update_comment: Optional[str]) -> int:
-    """プロジェクトの編集履歴を挿入"""
-    db = SessionLocal()
+def insert_canvas_version(project_id: int, user_id: int, field: Dict[str, Any],
+                          update_category: UpdateCategory, update_comment: Optional[str] = None) -> Optional[int]:
+    """キャンバスの新しい版（編集履歴＋詳細）を1トランザクションで登録し、edit_idを返す
+
+    次のバージョン番号はINSERT文内のサブクエリで求めるため、最新版を取得するための往復が不要
+    """
+    latest_version = select(EditHistory.version).filter(
+        EditHistory.project_id == project_id
+    ).order_by(EditHistory.last_updated.desc()).limit(1).scalar_subquery()
 
     values = {
         "project_id": project_id,
-        "version": version,
+        "version": func.coalesce(latest_version, 0) + 1,
         "user_id": user_id,
         "update_category": update_category,
     }
     if update_comment:
         values["update_comment"] = update_comment
-    query = insert(EditHistory).values(values)
-    try:
-        with db.begin():
-            result = db.execute(query)
-            edit_id = result.inserted_primary_key[0]
-            logger.info(f"編集履歴挿入成功: edit_id={edit_id}, project_id={project_id}")
-            return edit_id
-    except Exception as e:
-        db.rollback()
-        logger.error(f"編集履歴挿入エラー: {e}")
-        return 0
-    finally:
-        db.close()
 
-def insert_canvas_details(edit_id: int, field: Dict[str, Any]) -> bool:
-    """キャンバスの詳細情報を挿入"""
     db = SessionLocal()
-    query = insert(Detail).values(edit_id=edit_id, field=field)
     try:
         with db.begin():
-            result = db.execute(query)
-            detail_id = result.inserted_primary_key[0]
-            logger.info(f"キャンバス詳細挿入成功: detail_id={detail_id}, edit_id={edit_id}")
-            return True
+            edit_id = db.execute(
+                insert(EditHistory).values(values).returning(EditHistory.edit_id)
+            ).scalar_one()
+            db.execute(insert(Detail).values(edit_id=edit_id, field=field))
+            logger.info("キャンバス版登録成功: edit_id=%s, project_id=%s", edit_id, project_id)
+            return edit_id
     except Exception as e:
-        db.rollback()
-        logger.error(f"キャンバス詳細挿入エラー: {e}")
-        return False
+        logger.error("キャンバス版登録エラー: %s", e)
+        return None
     finally:
         db.close()
 
-def get_latest_version(project_id: int):
-    db = SessionLocal()
-    query = select(EditHistory).filter(
-        EditHistory.project_id == project_id
-            ).order_by(EditHistory.last_updated.desc()).limit(1)
+def iter_project_documents(project_id: int, user_id: Optional[int] = None,
+                           batch_size: int = 200) -> Iterator[Dict[str, Any]]:
+    """指定されたプロジェクトの文書一覧を1件ずつ返す（全件をリストにせず、batch_size件ずつDBから読み出す）
 
-    try:
-        with db.begin():
-            result = db.execute(query).scalars().first()
-            if result:
-                return result.version
-            return None
-
-    except Exception as e:
-        logger.error(f"最新のバージョン取得エラー: {e}")
-        return None
-    
-def get_project_documents(project_id: int) -> List[Dict[str, Any]]:
-    """指定されたプロジェクトの文書一覧取得"""
+    user_idを指定した場合は、プロジェクト所有者であることの確認も同じSELECT文で行う
+    （所有者でなければ0件）
+    """
     db = SessionLocal()
     try:
-        documents = db.query(Document).filter(
+        # アップロードユーザーのメールアドレスは文書ごとに問い合わせず、外部結合で一度に取得
+        query = select(
+            Document.document_id, Document.file_name, Document.file_type, Document.file_size,
+            User.email, Document.source_type, Document.uploaded_at
+        ).outerjoin(
+            User, User.user_id == Document.user_id
+        ).where(
             Document.project_id == project_id
-        ).order_by(Document.uploaded_at.desc()).all()
-
-        return [
-            {
-                "document_id": doc.document_id,
-                "file_name": doc.file_name,
-                "file_type": doc.file_type,
-                "file_size": doc.file_size,
-                "user_email": get_user_by_id(doc.user_id)["email"] if get_user_by_id(doc.user_id) else None,  # ここを修正
-                "source_type": doc.source_type.value,  # Enumなら .value
-                "uploaded_at": doc.uploaded_at,
+        ).order_by(Document.uploaded_at.desc())
+        if user_id is not None:
+            query = query.where(
+                select(Project.project_id).where(
+                    Project.project_id == Document.project_id,
+                    Project.user_id == user_id
+                ).exists()
+            )
+
+        for row in db.execute(query.execution_options(yield_per=batch_size)):
+            yield {
+                "document_id": row.document_id,
+                "file_name": row.file_name,
+                "file_type": row.file_type,
+                "file_size": row.file_size,
+                "user_email": row.email,
+                "source_type": row.source_type.value,  # Enumなら .value
+                "uploaded_at": row.uploaded_at,
             }
-            for doc in documents
-        ]
     except Exception as e:
-        logger.error(f"プロジェクト文書取得エラー: {e}")
-        return []
+        # 呼び出し元でエラーと分かるよう送出する（空や途中までの一覧として扱わせない）
+        logger.error("プロジェクト文書取得エラー: %s", e)
+        raise
     finally:
         db.close()
 
@@ -599,32 +820,35 @@ def get_document_by_id(document_id: int, user_id: int) -> Optional[Dict[str, Any
         return None
         
     except Exception as e:
-        logger.error(f"文書取得エラー: {e}")
+        logger.error("文書取得エラー: %s", e)
         return None
     finally:
         db.close()
 
-def delete_documents_record(document_id: int, user_id: int) -> bool:
-    """指定された文書を削除"""
+def delete_documents_record(document_id: int, user_id: int, project_id: Optional[int] = None) -> bool:
+    """指定された文書を削除（権限・プロジェクトの確認も同じDELETE文で行い、チャンクはON DELETE CASCADEで削除）"""
     
     db = SessionLocal()
     try:
         with db.begin():
-            delete_query = delete(Document).where(
+            conditions = [
                 Document.document_id == document_id,
                 Document.user_id == user_id
-            )
+            ]
+            if project_id is not None:
+                conditions.append(Document.project_id == project_id)
+            delete_query = delete(Document).where(*conditions)
             delete_result = db.execute(delete_query)
             
             if delete_result.rowcount == 0:
-                logger.warning(f"削除実行失敗: document_id={document_id}")
+                logger.warning("削除実行失敗: document_id=%s", document_id)
                 return False
             
-            logger.info(f"文書削除成功: document_id={document_id}")
+            logger.info("文書削除成功: document_id=%s", document_id)
             return True
         
     except Exception as e:
-        logger.error(f"文書削除エラー: {e}")
+        logger.error("文書削除エラー: %s", e)
         return False
     finally:
         db.close()
@@ -668,11 +892,11 @@ def record_consistency_check(project_id: int, user_id: int, analysis_result: Dic
             session.add(canvas_detail)
             session.commit()
             
-            logger.info(f"整合性確認結果を記録しました: project_id={project_id}, edit_id={edit_history.edit_id}")
+            logger.info("整合性確認結果を記録しました: project_id=%s, edit_id=%s", project_id, edit_history.edit_id)
             return True
             
     except Exception as e:
-        logger.error(f"整合性確認結果の記録エラー: {e}")
+        logger.error("整合性確認結果の記録エラー: %s", e)
         return False
 
 def insert_research_result(edit_id: int, user_id: int, result_text: str) -> bool:
@@ -682,11 +906,11 @@ def insert_research_result(edit_id: int, user_id: int, result_text: str) -> bool
         with db.begin():
             result = db.execute(query)
             research_id = result.inserted_primary_key[0]
-            logger.info(f"リサーチ結果挿入成功: research_id={research_id}, edit_id={edit_id}")
+            logger.info("リサーチ結果挿入成功: research_id=%s, edit_id=%s", research_id, edit_id)
             return True
     except Exception as e:
         db.rollback()
-        logger.error(f"リサーチ結果挿入エラー: {e}")
+        logger.error("リサーチ結果挿入エラー: %s", e)
         return False
     finally:
         db.close()
@@ -697,11 +921,11 @@ def remove_research_result(research_id: int):
     try:
         with db.begin():
             db.execute(query)
-            logger.info(f"リサーチ結果削除成功: research_id={research_id}")
+            logger.info("リサーチ結果削除成功: research_id=%s", research_id)
             return True
     except Exception as e:
         db.rollback()
-        logger.error(f"リサーチ結果削除エラー: {e}")
+        logger.error("リサーチ結果削除エラー: %s", e)
         return False
     finally:
         db.close()
@@ -724,16 +948,28 @@ def insert_interview_notes(edit_id: Optional[int], project_id: int, user_id: int
         with db.begin():
             result = db.execute(query)
             note_id = result.inserted_primary_key[0]
-            logger.info(f"インタビューノート挿入成功: note_id={note_id}, project_id={project_id}")
+            logger.info("インタビューノート挿入成功: note_id=%s, project_id=%s", note_id, project_id)
             return note_id
     except Exception as e:
         db.rollback()
-        logger.error(f"インタビューノート挿入エラー: {e}")
+        logger.error("インタビューノート挿入エラー: %s", e)
         return None
     finally:
         db.close()
 
-def get_all_interview_notes(project_id: int):
+def get_all_interview_notes(
+    project_id: int,
+    limit: Optional[int] = None,
+    before_date: Optional[date] = None,
+    interview_type: Optional[InterviewType] = None,
+    before_created_at: Optional[datetime] = None,
+):
+    """プロジェクトのインタビューメモを新しい順（interview_date, created_at の降順）に取得（絞り込み・件数制限はSQL側で行う）
+
+    キーセット方式のページング: 前ページ最後のメモの interview_date と created_at を
+    before_date / before_created_at に渡すと、その続きから返す（同じ日付のメモも取りこぼさない）。
+    before_date だけを指定した場合は、その日付より前のメモだけを返す
+    """
     db = SessionLocal()
     query = select(
         InterviewNote.note_id,  # 追加
@@ -745,32 +981,32 @@ def get_all_interview_notes(project_id: int):
         User.email,
         InterviewNote.interview_note,
         InterviewNote.interview_type,
+        InterviewNote.created_at,  # 次ページ取得用のカーソル
     )\
     .join(EditHistory, InterviewNote.edit_id == EditHistory.edit_id, isouter=True)\
     .join(User, InterviewNote.user_id == User.user_id, isouter=True)\
     .filter(InterviewNote.project_id == project_id)
+    if before_date is not None and before_created_at is not None:
+        # 並び順と同じ (interview_date, created_at) の行値比較で続きを取得する
+        query = query.filter(
+            tuple_(InterviewNote.interview_date, InterviewNote.created_at) < tuple_(before_date, before_created_at)
+        )
+    elif before_date is not None:
+        query = query.filter(InterviewNote.interview_date < before_date)
+    if interview_type is not None:
+        query = query.filter(InterviewNote.interview_type == interview_type)
+    # (project_id, interview_date, created_at) のインデックスを逆順に走査し、LIMIT件で打ち切る
+    query = query.order_by(InterviewNote.interview_date.desc(), InterviewNote.created_at.desc())
+    if limit is not None:
+        query = query.limit(limit)
     try:
         with db.begin():
-            rows = db.execute(query).all()
-            if not rows:
-                return None
-            result = []
-            for note_id, name, idate, user_id, edit_id, version, email, interview_note, interview_type in rows:
-                result.append({
-                    "note_id": note_id,  # 追加
-                    "interviewee_name": name,
-                    "interview_date": idate,
-                    "user_id": user_id,
-                    "edit_id": edit_id,
-                    "version": version,
-                    "email": email,
-                    "interview_note": interview_note,
-                    "interview_type": interview_type,
-                })
-            return result
+            # 列名をそのままキーにする（行ごとに辞書リテラルを組み立てない）
+            result = [dict(row) for row in db.execute(query).mappings()]
+            return result or None
     except Exception as e:
         db.rollback()
-        logger.error(f"インタビューノート取得エラー: {e}")
+        logger.error("インタビューノート取得エラー: %s", e)
         return False
     finally:
         db.close()
@@ -779,203 +1015,101 @@ def get_interview_note_by_id(note_id: int) -> Optional[Dict[str, Any]]:
     """指定されたnote_idのインタビューメモを1件取得"""
     db = SessionLocal()
     try:
-        note = db.query(InterviewNote).filter(InterviewNote.note_id == note_id).first()
-        if note:
-            return {
-                "note_id": note.note_id,
-                "edit_id": note.edit_id,
-                "project_id": note.project_id,
-                "user_id": note.user_id,
-                "interviewee_name": note.interviewee_name,
-                "interview_date": note.interview_date,
-                "interview_type": note.interview_type,
-                "interview_note": note.interview_note,
-                "created_at": note.created_at,
-            }
-        return None
+        query = select(
+            InterviewNote.note_id, InterviewNote.edit_id, InterviewNote.project_id, InterviewNote.user_id,
+            InterviewNote.interviewee_name, InterviewNote.interview_date, InterviewNote.interview_type,
+            InterviewNote.interview_note, InterviewNote.created_at
+        ).where(InterviewNote.note_id == note_id)
+        row = db.execute(query).mappings().first()
+        return dict(row) if row else None
     except Exception as e:
-        logger.error(f"インタビューメモ取得エラー: {e}")
+        logger.error("インタビューメモ取得エラー: %s", e)
         return None
     finally:
         db.close()
     
-def delete_one_note(note_id: int) -> bool:
+def delete_one_note(note_id: int, project_id: Optional[int] = None) -> bool:
+    """インタビューメモを削除（project_idを指定した場合は所属プロジェクトの確認も同じDELETE文で行う）"""
     db = SessionLocal()
     query = delete(InterviewNote).where(InterviewNote.note_id == note_id)
+    if project_id is not None:
+        query = query.where(InterviewNote.project_id == project_id)
     try:
         with db.begin():
             result = db.execute(query)
             if result.rowcount == 0:
-                logger.warning(f"インタビューノート削除失敗: note_id={note_id} は存在しません")
-                return False
-            logger.info(f"インタビューノート削除成功: note_id={note_id}")
-            return True
-    except Exception as e:
-        db.rollback()
-        logger.error(f"インタビューノート削除エラー: {e}")
-        return False
-    finally:
-        db.close()
-
-def get_all_edit_ids(project_id: int, user_id: int) -> List[int]:
-    db = SessionLocal()
-    query = select(EditHistory.edit_id).filter(EditHistory.project_id == project_id, EditHistory.user_id == user_id)
-    try:
-        with db.begin():
-            rows = db.execute(query).all()
-            return [row[0] for row in rows]
-    except Exception as e:
-        db.rollback()
-        logger.error(f"編集履歴取得エラー: {e}")
-        return []
-    finally:
-        db.close()
-
-def remove_detail(edit_id: int) -> bool:
-    db = SessionLocal()
-    query = delete(Detail).where(Detail.edit_id == edit_id)
-    try:
-        with db.begin():
-            result = db.execute(query)
-            if result.rowcount == 0:
-                logger.warning(f"詳細削除失敗: edit_id={edit_id} は存在しません")
+                logger.warning("インタビューノート削除失敗: note_id=%s は存在しません", note_id)
                 return False
-            logger.info(f"詳細削除成功: edit_id={edit_id}")
+            logger.info("インタビューノート削除成功: note_id=%s", note_id)
             return True
     except Exception as e:
         db.rollback()
-        logger.error(f"詳細削除エラー: {e}")
+        logger.error("インタビューノート削除エラー: %s", e)
         return False
     finally:
         db.close()
 
-def get_research_id(edit_id: int, user_id: int) -> int:
-    db = SessionLocal()
-    query = select(ResearchResult.research_id).filter(ResearchResult.edit_id == edit_id, ResearchResult.user_id == user_id)
-    try:
-        with db.begin():
-            result = db.execute(query)
-            return result.scalar() or 0
-    except Exception as e:
-        db.rollback()
-        logger.error(f"リサーチID取得エラー: {e}")
-        return 0
-    finally:
-        db.close()
+def delete_project_with_contents(project_id: int, user_id: int) -> Optional[bool]:
+    """プロジェクトと関連データを1トランザクションでまとめて削除
 
-def get_note_id(edit_id: int, project_id: int, user_id: int) -> int:
-    db = SessionLocal()
-    query = select(InterviewNote.note_id).filter(InterviewNote.edit_id == edit_id, InterviewNote.project_id == project_id, InterviewNote.user_id == user_id)
-    try:
-        with db.begin():
-            result = db.execute(query)
-            return result.scalar() or 0
-    except Exception as e:
-        db.rollback()
-        logger.error(f"インタビューノートID取得エラー: {e}")
-        return 0
-    finally:
-        db.close()
+    編集ごとに「ID取得→削除」を繰り返さず、テーブルごとに1回のDELETE文で削除する
+    （文書のチャンクはON DELETE CASCADEで削除）
+    戻り値: 削除した場合True、プロジェクトが存在しない場合False、エラー時None
+    """
+    edit_ids = select(EditHistory.edit_id).where(
+        EditHistory.project_id == project_id,
+        EditHistory.user_id == user_id
+    ).scalar_subquery()
 
-def get_doc_id(project_id: int, user_id: int) -> int:
     db = SessionLocal()
-    query = select(Document.document_id).filter(Document.project_id == project_id, Document.user_id == user_id)
     try:
         with db.begin():
-            result = db.execute(query)
-            return result.scalar() or 0
-    except Exception as e:
-        db.rollback()
-        logger.error(f"ドキュメントID取得エラー: {e}")
-        return 0
-    finally:
-        db.close()
-
-def delete_edit_history(project_id: int) -> bool:
-    db = SessionLocal()
-    query = delete(EditHistory).where(EditHistory.project_id == project_id)
-    try:
-        with db.begin():
-            result = db.execute(query)
-            if result.rowcount == 0:
-                logger.warning(f"編集履歴削除失敗: project_id={project_id} は存在しません")
-                return False
-            logger.info(f"編集履歴削除成功: project_id={project_id}")
-            return True
-    except Exception as e:
-        db.rollback()
-        logger.error(f"編集履歴削除エラー: {e}")
-        return False
-    finally:
-        db.close()
-
-def delete_members(project_id: int) -> bool:
-    db = SessionLocal()
-    query = delete(ProjectMember).where(ProjectMember.project_id == project_id)
-    try:
-        with db.begin():
-            result = db.execute(query)
-            if result.rowcount == 0:
-                logger.warning(f"プロジェクトメンバー削除失敗: project_id={project_id} は存在しません")
-                return False
-            logger.info(f"プロジェクトメンバー削除成功: project_id={project_id}")
-            return True
-    except Exception as e:
-        db.rollback()
-        logger.error(f"プロジェクトメンバー削除エラー: {e}")
-        return False
-    finally:
-        db.close()
-
-def delete_project(project_id: int) -> bool:
-    db = SessionLocal()
-    query = delete(Project).where(Project.project_id == project_id)
-    try:
-        with db.begin():
-            result = db.execute(query)
-            if result.rowcount == 0:
-                logger.warning(f"プロジェクト削除失敗: project_id={project_id} は存在しません")
-                return False
-            logger.info(f"プロジェクト削除成功: project_id={project_id}")
-            return True
+            db.execute(delete(Detail).where(Detail.edit_id.in_(edit_ids)))
+            db.execute(delete(ResearchResult).where(
+                ResearchResult.edit_id.in_(edit_ids),
+                ResearchResult.user_id == user_id
+            ))
+            db.execute(delete(InterviewNote).where(
+                InterviewNote.project_id == project_id,
+                InterviewNote.user_id == user_id
+            ))
+            db.execute(delete(Document).where(
+                Document.project_id == project_id,
+                Document.user_id == user_id
+            ))
+            db.execute(delete(EditHistory).where(EditHistory.project_id == project_id))
+            db.execute(delete(ProjectMember).where(ProjectMember.project_id == project_id))
+            deleted = db.execute(
+                delete(Project).where(Project.project_id == project_id).returning(Project.project_id)
+            ).first()
+        if deleted is None:
+            logger.warning("プロジェクト削除失敗: project_id=%s は存在しません", project_id)
+            return False
+        logger.info("プロジェクト削除成功: project_id=%s", project_id)
+        return True
     except Exception as e:
-        db.rollback()
-        logger.error(f"プロジェクト削除エラー: {e}")
-        return False
+        logger.error("プロジェクト削除エラー: %s", e)
+        return None
     finally:
+        _project_cache.pop(project_id)
         db.close()
 
 # === RAG機能用追加 START ===
-# 注意: データベーススキーマ適用前のため一時的にコメントアウト
-
-# class Document(Base):
-#     """ドキュメントテーブル（RAG対応）"""
-#     __tablename__ = 'documents'
-# 
-#     document_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-#     user_id: Mapped[int] = mapped_column(Integer, ForeignKey('users.user_id'), nullable=False)
-#     project_id: Mapped[int] = mapped_column(Integer, ForeignKey('projects.project_id'), nullable=False)
-#     file_name: Mapped[str] = mapped_column(VARCHAR(255), nullable=False)
-#     file_path: Mapped[Optional[str]] = mapped_column(VARCHAR(500), nullable=True)  # RAG: NULL許可
-#     file_type: Mapped[str] = mapped_column(VARCHAR(50), nullable=False)
-#     file_size: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
-#     source_type: Mapped[str] = mapped_column(VARCHAR(50), nullable=False)
-#     uploaded_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), nullable=False)
-#     processing_status: Mapped[str] = mapped_column(VARCHAR(20), default='pending', nullable=False)
-# 
-#     user = relationship("User", backref="documents")
-#     project = relationship("Project", backref="documents")
 
 class DocumentChunk(Base):
     """ドキュメントチャンクテーブル（RAG用ベクトル保存）"""
     __tablename__ = 'document_chunks'
+    __table_args__ = (
+        # チャンクの再登録時のDELETEと、文書削除時のON DELETE CASCADEで全件走査にならないように
+        Index('ix_document_chunks_document_id_chunk_order', 'document_id', 'chunk_order'),
+    )
 
     chunk_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     document_id: Mapped[int] = mapped_column(Integer, ForeignKey('documents.document_id', ondelete='CASCADE'), nullable=False)
     chunk_text: Mapped[str] = mapped_column(Text, nullable=False)
     chunk_order: Mapped[int] = mapped_column(Integer, nullable=False)
     embedding: Mapped[Optional[str]] = mapped_column(Text, nullable=True)  # pgvector型（文字列として扱う）
-    chunk_metadata: Mapped[Optional[dict]] = mapped_column(JSON, nullable=True)
+    chunk_metadata: Mapped[Optional[dict]] = mapped_column(JSONB, nullable=True)  # 読み出し時の再パースを避けるためjsonb
 
     document = relationship("Document", backref="chunks")
 
@@ -1000,6 +1134,9 @@ class TextDocumentResponse(BaseModel):
     uploaded_at: datetime
 
 class SearchRequest(BaseModel):
+    # 型変換を行わない厳格モード（JSONの型がそのまま一致する前提）
+    model_config = ConfigDict(strict=True)
+
     query: str
     limit: Optional[int] = 10
 
@@ -1010,6 +1147,8 @@ class SearchResult(BaseModel):
     source_type: str
 
 class CanvasGenerationRequest(BaseModel):
+    model_config = ConfigDict(strict=True)
+
     idea_description: str
     target_audience: Optional[str] = None
     industry: Optional[str] = None
@@ -1083,103 +1222,142 @@ def create_document_record(user_id: int, project_id: int, file_name: str,
         db.commit()
         db.refresh(new_doc)
         
-        logger.info(f"ドキュメント記録作成成功: {file_name} (ID: {new_doc.document_id})")
+        logger.info("ドキュメント記録作成成功: %s (ID: %s)", file_name, new_doc.document_id)
         return new_doc.document_id
         
     except Exception as e:
         db.rollback()
-        logger.error(f"ドキュメント記録作成エラー: {e}")
+        logger.error("ドキュメント記録作成エラー: %s", e)
         return None
     finally:
         db.close()
 
-# def update_document_processing_status(document_id: int, status: str) -> bool:
-#     """ドキュメント処理状況を更新"""
-#     db = SessionLocal()
-#     try:
-#         doc = db.query(Document).filter(Document.document_id == document_id).first()
-#         if doc:
-#             doc.processing_status = status
-#             if status == 'completed':
-#                 doc.file_path = None  # RAG処理完了後はfile_pathをクリア
-#             db.commit()
-#             logger.info(f"ドキュメント処理状況更新: {document_id} -> {status}")
-#             return True
-#         return False
-#         
-#     except Exception as e:
-#         db.rollback()
-#         logger.error(f"ドキュメント処理状況更新エラー: {e}")
-#         return False
-#     finally:
-#         db.close()
-
-# def get_project_documents(project_id: int, user_id: int) -> List[Dict[str, Any]]:
-#     """プロジェクトのドキュメント一覧取得"""
-#     db = SessionLocal()
-#     try:
-#         docs = db.query(Document).filter(
-#             Document.project_id == project_id,
-#             Document.user_id == user_id
-#         ).order_by(Document.uploaded_at.desc()).all()
-#         
-#         result = []
-#         for doc in docs:
-#             # チャンク数を取得
-#             chunk_count = db.query(DocumentChunk).filter(
-#                 DocumentChunk.document_id == doc.document_id
-#             ).count()
-#             
-#             result.append({
-#                 "document_id": doc.document_id,
-#                 "file_name": doc.file_name,
-#                 "file_type": doc.file_type,
-#                 "file_size": doc.file_size,
-#                 "source_type": doc.source_type,
-#                 "processing_status": doc.processing_status,
-#                 "chunks_count": chunk_count,
-#                 "uploaded_at": doc.uploaded_at
-#             })
-#         
-#         return result
-#         
-#     except Exception as e:
-#         logger.error(f"プロジェクトドキュメント取得エラー: {e}")
-#         return []
-#     finally:
-#         db.close()
+def update_document_processing_status(document_id: int, status: str) -> bool:
+    """ドキュメント処理状況を更新（pending → processing → completed / failed）"""
+    db = SessionLocal()
+    query = update(Document).where(Document.document_id == document_id).values(processing_status=status)
+    try:
+        with db.begin():
+            result = db.execute(query)
+            if result.rowcount == 0:
+                logger.warning("ドキュメント処理状況更新失敗: document_id=%s は存在しません", document_id)
+                return False
+            logger.info("ドキュメント処理状況更新: %s -> %s", document_id, status)
+            return True
+    except Exception as e:
+        db.rollback()
+        logger.error("ドキュメント処理状況更新エラー: %s", e)
+        return False
+    finally:
+        db.close()
+
+def touch_document_heartbeats(document_ids: List[int]) -> bool:
+    """このプロセスが受け付けた未完了ドキュメントの生存確認時刻を更新"""
+    if not document_ids:
+        return True
+    query = update(Document)\
+        .where(
+            Document.document_id.in_(document_ids),
+            Document.processing_status.in_(('pending', 'processing')),
+        )\
+        .values(processing_heartbeat=func.now())
+    db = SessionLocal()
+    try:
+        with db.begin():
+            db.execute(query)
+        return True
+    except Exception as e:
+        db.rollback()
+        logger.error("ドキュメント生存確認時刻の更新エラー: %s", e)
+        return False
+    finally:
+        db.close()
 
-def delete_document_record(document_id: int, user_id: int) -> bool:
-    """ドキュメント記録を削除"""
+def mark_unfinished_documents_failed(document_ids: List[int]) -> int:
+    """指定した未完了（pending / processing）のドキュメントを failed にする（更新件数を返す）"""
+    if not document_ids:
+        return 0
+    query = update(Document)\
+        .where(
+            Document.document_id.in_(document_ids),
+            Document.processing_status.in_(('pending', 'processing')),
+        )\
+        .values(processing_status='failed')
+    return _fail_documents(query)
+
+def mark_stale_documents_failed(stale_after_seconds: float) -> int:
+    """生存確認が stale_after_seconds 秒以上途絶えた未完了ドキュメントを failed にする
+
+    処理を受け付けたプロセスが終了して取り残されたものだけが対象で、
+    稼働中の他プロセスが処理待ち・処理中のドキュメントには触れない。更新件数を返す
+    """
+    last_seen = func.coalesce(Document.processing_heartbeat, Document.uploaded_at)
+    query = update(Document)\
+        .where(
+            Document.processing_status.in_(('pending', 'processing')),
+            last_seen < func.now() - timedelta(seconds=stale_after_seconds),
+        )\
+        .values(processing_status='failed')
+    return _fail_documents(query)
+
+def _fail_documents(query) -> int:
+    """ドキュメントを failed にするUPDATEを実行して更新件数を返す"""
     db = SessionLocal()
     try:
-        logger.info(f"ドキュメント削除開始: document_id={document_id}, user_id={user_id}")
-        
-        doc = db.query(Document).filter(
-            Document.document_id == document_id
-        ).first()
+        with db.begin():
+            count = db.execute(query).rowcount
+        if count:
+            logger.warning("未完了のドキュメント %s 件を failed にしました", count)
+        return count
+    except Exception as e:
+        db.rollback()
+        logger.error("未完了ドキュメントの処理状況更新エラー: %s", e)
+        return 0
+    finally:
+        db.close()
+
+def get_document_processing_status(document_id: int, user_id: int) -> Optional[Dict[str, Any]]:
+    """ドキュメントの処理状況を取得（ユーザー権限チェック付き）"""
+    db = SessionLocal()
+    try:
+        query = select(Document.document_id, Document.project_id, Document.processing_status).filter(
+            Document.document_id == document_id,
+            Document.user_id == user_id
+        )
+        result = db.execute(query).first()
+        if result:
+            return {
+                "document_id": result.document_id,
+                "project_id": result.project_id,
+                "processing_status": result.processing_status
+            }
+        return None
         
-        if doc:
-            logger.info(f"削除対象ドキュメント見つかりました: {doc.file_name}")
-            
-            # まず関連するチャンクを削除
-            chunks_deleted = db.query(DocumentChunk).filter(
-                DocumentChunk.document_id == document_id
-            ).delete()
-            logger.info(f"削除したチャンク数: {chunks_deleted}")
-            
-            # 次にドキュメント本体を削除
-            db.delete(doc)
-            db.commit()
-            logger.info(f"ドキュメント削除成功: {document_id}")
+    except Exception as e:
+        logger.error("ドキュメント処理状況取得エラー: %s", e)
+        return None
+    finally:
+        db.close()
+
+def delete_document_record(document_id: int, user_id: int) -> bool:
+    """ドキュメント記録を削除（チャンクはdocument_chunksのON DELETE CASCADEで削除）"""
+    db = SessionLocal()
+    query = delete(Document).where(
+        Document.document_id == document_id,
+        Document.user_id == user_id
+    ).returning(Document.file_name)
+    try:
+        with db.begin():
+            file_name = db.execute(query).scalar_one_or_none()
+            if file_name is None:
+                logger.warning("削除対象ドキュメントが見つかりません: document_id=%s, user_id=%s", document_id, user_id)
+                return False
+            logger.info("ドキュメント削除成功: %s (%s)", document_id, file_name)
             return True
-        else:
-            logger.warning(f"削除対象ドキュメントが見つかりません: document_id={document_id}, user_id={user_id}")
-            return False
         
     except Exception as e:
         db.rollback()
-        logger.error(f"ドキュメント削除エラー: {e}")
+        logger.error("ドキュメント削除エラー: %s", e)
         return False
     finally:
         db.close()
@@ -1202,7 +1380,7 @@ def get_project_history_list(project_id: int) -> list:
             })
         return result
     except Exception as e:
-        logger.error(f"編集履歴リスト取得エラー: {e}")
+        logger.error("編集履歴リスト取得エラー: %s", e)
         return []
     finally:
         db.close()
@@ -1219,34 +1397,32 @@ def get_edit_id_by_version(project_id: int, version: int) -> int | None:
             return result.edit_id
         return None
     except Exception as e:
-        logger.error(f"edit_id取得エラー: {e}")
+        logger.error("edit_id取得エラー: %s", e)
         return None
     finally:
         db.close()
 
-def get_project_research_results(project_id: int) -> list:
-    """指定されたproject_idのリサーチ履歴（research_resultsの全項目）を取得"""
+def iter_project_research_results(project_id: int, batch_size: int = 100) -> Iterator[Dict[str, Any]]:
+    """指定されたproject_idのリサーチ履歴を1件ずつ返す（結果本文が長いため、batch_size件ずつDBから読み出す）"""
     db = SessionLocal()
     try:
-        results = db.query(ResearchResult, EditHistory, User).\
-            join(EditHistory, ResearchResult.edit_id == EditHistory.edit_id).\
-            join(User, ResearchResult.user_id == User.user_id).\
-            filter(EditHistory.project_id == project_id).\
-            order_by(ResearchResult.researched_at.desc()).all()
-        research_list = []
-        for rr, eh, user in results:
-            research_list.append({
-                "research_id": rr.research_id,
-                "edit_id": rr.edit_id,
-                "user_id": rr.user_id,
-                "user_email": user.email,
-                "researched_at": rr.researched_at,
-                "result_text": rr.result_text,
-            })
-        return research_list
+        # 返却する列だけを取得（edit_history・usersのエンティティ全体は読み込まない）
+        query = select(
+            ResearchResult.research_id, ResearchResult.edit_id, ResearchResult.user_id,
+            User.email.label("user_email"), ResearchResult.researched_at, ResearchResult.result_text
+        ).join(
+            EditHistory, ResearchResult.edit_id == EditHistory.edit_id
+        ).join(
+            User, ResearchResult.user_id == User.user_id
+        ).where(
+            EditHistory.project_id == project_id
+        ).order_by(ResearchResult.researched_at.desc())
+        for row in db.execute(query.execution_options(yield_per=batch_size)).mappings():
+            yield dict(row)
     except Exception as e:
-        logger.error(f"リサーチ履歴取得エラー: {e}")
-        return []
+        # 呼び出し元でエラーと分かるよう送出する（空や途中までの一覧として扱わせない）
+        logger.error("リサーチ履歴取得エラー: %s", e)
+        raise
     finally:
         db.close()
 
@@ -1254,30 +1430,29 @@ def get_research_result_by_id(research_id: int) -> dict | None:
     """指定されたresearch_idのリサーチ内容を1件取得"""
     db = SessionLocal()
     try:
-        result = db.query(ResearchResult, User).\
-            join(User, ResearchResult.user_id == User.user_id).\
-            filter(ResearchResult.research_id == research_id).first()
-        if result:
-            rr, user = result
-            return {
-                "research_id": rr.research_id,
-                "edit_id": rr.edit_id,
-                "user_id": rr.user_id,
-                "user_email": user.email,
-                "researched_at": rr.researched_at,
-                "result_text": rr.result_text,
-            }
-        return None
+        query = select(
+            ResearchResult.research_id, ResearchResult.edit_id, ResearchResult.user_id,
+            User.email.label("user_email"), ResearchResult.researched_at, ResearchResult.result_text
+        ).join(
+            User, ResearchResult.user_id == User.user_id
+        ).where(ResearchResult.research_id == research_id)
+        row = db.execute(query).mappings().first()
+        return dict(row) if row else None
     except Exception as e:
-        logger.error(f"リサーチ内容取得エラー: {e}")
+        logger.error("リサーチ内容取得エラー: %s", e)
         return None
     finally:
         db.close()
 
-def update_interview_notes(note_id: int, interviewee_name: str, interview_date: date, interview_type: str, interview_note: str) -> bool:
+def update_interview_notes(note_id: int, interviewee_name: str, interview_date: date, interview_type: str, interview_note: str,
+                           project_id: Optional[int] = None) -> bool:
+    """インタビューメモを更新（project_idを指定した場合は所属プロジェクトの確認も同じUPDATE文で行う）"""
     db = SessionLocal()
     try:
-        query = update(InterviewNote).where(InterviewNote.note_id == note_id).values(
+        conditions = [InterviewNote.note_id == note_id]
+        if project_id is not None:
+            conditions.append(InterviewNote.project_id == project_id)
+        query = update(InterviewNote).where(*conditions).values(
             interviewee_name=interviewee_name,
             interview_date=interview_date,
             interview_type=interview_type,
@@ -1286,13 +1461,13 @@ def update_interview_notes(note_id: int, interviewee_name: str, interview_date:
         with db.begin():
             result = db.execute(query)
             if result.rowcount == 0:
-                logger.warning(f"インタビューノート更新失敗: note_id={note_id} は存在しません")
+                logger.warning("インタビューノート更新失敗: note_id=%s は存在しません", note_id)
                 return False
-            logger.info(f"インタビューノート更新成功: note_id={note_id}")
+            logger.info("インタビューノート更新成功: note_id=%s", note_id)
             return True
     except Exception as e:
         db.rollback()
-        logger.error(f"インタビューノート更新エラー: {e}")
+        logger.error("インタビューノート更新エラー: %s", e)
         return False
     finally:
         db.close()
@@ -1,44 +1,54 @@
 # Idea Spark - 新規事業開発支援WebアプリケーションのメインAPI
-from fastapi import FastAPI, HTTPException, Depends, Cookie, Response, Request, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, Depends, Cookie, Response, Request, UploadFile, File, Form, Query
 from fastapi.middleware.cors import CORSMiddleware
-from datetime import datetime, timedelta
-from typing import Optional, List
+from fastapi.responses import StreamingResponse, ORJSONResponse
+from contextlib import asynccontextmanager
+from pydantic import BaseModel
+from datetime import date, datetime, timedelta
+from typing import Iterator, Optional, List, Literal, Set
 import logging
 import os
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
+import asyncio
 import json
+import re
+import threading
+import orjson
 
 load_dotenv()
 api_key = os.getenv("API_KEY")
 client = OpenAI(api_key=api_key)
+# ストリーミング応答用（イベントループをブロックしない）
+async_client = AsyncOpenAI(api_key=api_key)
 
 # ローカルモジュールインポート
-from connect_PostgreSQL import test_database_connection
+from connect_PostgreSQL import test_database_connection, run_db, get_pool_status, check_pool_capacity, warm_up_pool, close_db
 from db_operations import (
-    UserCreate, UserLogin, AuthResponse, UserResponse, ProjectResponse, ProjectCreateRequest, ProjectWithAI, ProjectUpdateRequest, InterviewNotesRequest,
-    create_user, authenticate_user, create_session, validate_session, 
-    get_user_by_id, get_user_projects, create_tables, get_latest_edit_id, get_project_documents,
-    get_canvas_details, get_latest_version, get_project_by_id,
-    insert_project, insert_edit_history, insert_canvas_details, 
+    UserCreate, UserLogin, AuthResponse, UserResponse, ProjectResponse, ProjectCreateRequest, ProjectWithAI, ProjectUpdateRequest, InterviewNotesRequest, InterviewType,
+    create_user, authenticate_user, create_session, validate_session, invalidate_session, 
+    get_user_by_id, get_user_projects, create_tables, iter_project_documents,
+    get_canvas_details, get_latest_canvas_details, get_project_with_latest_canvas, get_project_by_id,
+    insert_project, insert_canvas_version, 
     insert_research_result, remove_research_result, insert_interview_notes, get_all_interview_notes, delete_one_note, 
-    delete_documents_record, get_document_by_id, delete_document_record,
-    get_all_edit_ids, remove_detail, get_research_id, get_note_id, get_doc_id, 
-    delete_edit_history, delete_members, delete_project,
+    delete_documents_record, delete_document_record,
+    delete_project_with_contents,
     # RAG機能用追加
     DocumentUploadResponse, TextDocumentResponse, SearchRequest, SearchResult, CanvasGenerationRequest,
     create_document_record,  # 追加
+    update_document_processing_status, mark_unfinished_documents_failed, mark_stale_documents_failed, touch_document_heartbeats, get_document_processing_status,
     # 整合性確認機能用追加
     ConsistencyCheckRequest, ConsistencyCheckResponse,
     # AI回答自動生成機能用追加
     AutoAnswerGenerationRequest, AutoAnswerGenerationResponse,
     # リーンキャンバス更新案生成機能用追加
     CanvasUpdateRequest, CanvasUpdateResponse,
-    InterviewToCanvasRequest, InterviewToCanvasResponse, get_interview_note_by_id, get_project_history_list, get_edit_id_by_version, get_project_research_results, get_research_result_by_id,
+    InterviewToCanvasRequest, InterviewToCanvasResponse, get_interview_note_by_id, get_project_history_list, get_edit_id_by_version, iter_project_research_results, get_research_result_by_id,
     update_interview_notes # ← update_interview_notesを追加
 )
 
 # RAG機能用サービス
+from services.cache_service import TTLCache
 from services.file_service import FileService
 from services.rag_service import RAGService
 # 整合性確認機能用サービス
@@ -48,30 +58,156 @@ from services.auto_answer_service import AutoAnswerService
 # リーンキャンバス更新案生成機能用サービス
 from services.canvas_update_service import CanvasUpdateService
 
-# ログ設定
+# ログ設定（LOG_LEVEL で変更可能）
 logging.basicConfig(
-    level=logging.INFO,
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """アプリケーションの起動・終了処理（DBの準備とコネクションプールの後始末）"""
+    logger.info("アプリケーションを起動しています...")
+    create_tables()
+    check_pool_capacity()
+    warm_up_pool()
+    # 受け付けたプロセスが終了して取り残されたドキュメントは再開できないため failed にする
+    # （生存確認が途絶えたものだけが対象。稼働中の他ワーカーが受け付けたものには触れない）
+    mark_stale_documents_failed(_RAG_STALE_SECONDS)
+    _start_rag_workers()
+    logger.info("アプリケーションの起動が完了しました")
+    yield
+    await _stop_rag_workers()
+    close_db()
+    logger.info("DB接続を閉じました")
+
 app = FastAPI(
     title="Idea Spark API",
     description="新規事業開発支援WebアプリケーションのAPI",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse,  # 大きな検索結果・キャンバスをorjsonで高速にシリアライズ
+    lifespan=lifespan,
 )
 
-allowed_origins = os.getenv("ALLOWED_ORIGINS", "http://localhost:3000,http://127.0.0.1:3000").split(",")
-logger.info(f"CORS allowed origins: {allowed_origins}")
+# 起動時に一度だけパースする（"*" 指定時は資格情報なしのワイルドカードとして扱う）
+allowed_origins = frozenset(
+    origin.strip()
+    for origin in os.getenv("ALLOWED_ORIGINS", "http://localhost:3000,http://127.0.0.1:3000").split(",")
+    if origin.strip()
+)
+allow_any_origin = "*" in allowed_origins
+logger.info("CORS allowed origins: %s", sorted(allowed_origins))
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"], # 本番環境ではallowed_originsを使用すること
-    allow_credentials=True,
+    allow_origins=["*"] if allow_any_origin else sorted(allowed_origins),
+    allow_credentials=not allow_any_origin,  # "*" と資格情報の併用は仕様違反
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
+# LLMプロンプトの固定部分（リクエストごとに組み立て直さないようモジュール読み込み時に一度だけ作成）
+_CANVAS_JSON_FORMAT = '{"idea_name": "", "Problem": "","Customer_Segments": "","Unique_Value_Proposition": "","Solution": "","Channels": "","Revenue_Streams": "","Cost_Structure": "","Key_Metrics": "","Unfair_Advantage": "","Early_Adopters": "","Existing_Alternatives": ""}'
+_CANVAS_PROMPT_PREFIX = (
+    '今から新規事業開発のリーンキャンバスを作成します。'
+    'アイデアの概要を以下に提示しますので、リーンキャンバスの各項目を日本語で作成してください。'
+    '解答には余計な文章を挿入せず、必ず以下の書式を埋める形で回答してください。idea_nameなどのkeyは日本語にせずそのまま返してください：'
+    + _CANVAS_JSON_FORMAT + ' ## アイデア概要'
+)
+
+_RESEARCH_PROMPT1 = '''新規事業開発に関する市場調査を行ってください。以下のビジネス概要に基づいて分析してください。
+
+## ビジネス概要
+{canvas}
+
+## 調査項目
+以下の観点で分析してください：
+- 3C分析（市場の成長性・競合状況・顧客ニーズ）
+- 技術調査（必要技術・実現可能性）
+- 法規制事項
+
+## 関連情報
+{document_context}
+
+## 回答形式
+以下の形式で回答してください：
+
+【市場調査結果】
+1. 市場の成長性
+2. 競合分析
+3. 顧客ニーズ調査
+
+【技術調査結果】
+1. 必要な技術と要求仕様
+2. 実現可能性
+
+【法規制事項】
+1. 規制'''
+
+_RESEARCH_PROMPT2 = '''現在リーンキャンバスをもとに新規事業開発を検討しています。
+
+## 現在のリーンキャンバス
+{canvas}
+
+## リサーチ結果
+{research}
+
+## 指示
+リサーチ結果を踏まえて、リーンキャンバスの各項目を更新すべき具体的な提案を行ってください。
+以下のJSON形式で、更新が必要な項目のみを含めて回答してください：
+
+```json
+{{
+  "updates": [
+    {{
+      "field": "キャンバス項目名（英語）",
+      "field_japanese": "キャンバス項目名（日本語）", 
+      "before": "現在の内容",
+      "after": "更新後の内容",
+      "reason": "更新理由の説明"
+    }}
+  ]
+}}
+```
+
+キャンバス項目名は以下から選択してください：
+- problem（顧客課題）
+- customer_segments（顧客セグメント）
+- unique_value_proposition（独自の価値提案）
+- solution（解決策）
+- channels（販路）
+- revenue_streams（収益の流れ）
+- cost_structure（費用構造）
+- key_metrics（主要指標）
+- unfair_advantage（圧倒的優位性）
+- early_adopters（アーリーアダプター）
+- existing_alternatives（代替品）
+
+更新例は元のリーンキャンバスの文体に合わせ、具体的で実用的な内容にしてください。'''
+
+_CPF_PURPOSE = 'CustomerとProblemの整合性、すなわち想定している顧客が本当にその課題を持っているか、その課題が本当に痛みを伴うものか'
+_PSF_PURPOSE = 'ProblemとSolutionの整合性、すなわち提案するソリューションが本当にその課題を解決できるか、顧客がそのソリューションを求めるか'
+_INTERVIEW_PURPOSES = {"CPF": _CPF_PURPOSE, "PSF": _PSF_PURPOSE}
+
+_INTERVIEWEE_PROMPT = (
+    '現在リーンキャンバスをもとに新規事業開発を検討しています。'
+    '開発の概要は以下の通りです。{canvas}'
+    'ここで、{purpose}を確認するためのインタビューを行いたいと考えています。'
+    '理想的なインタビュー対象者を、余計な文章を挿入せずに、必ず '
+    '属性: [属性の箇条書きリスト], 特徴: [特徴の箇条書きリスト], 選定基準: [選定基準の箇条書きリスト] のように、JSON形式で回答してください。'
+)
+_INTERVIEW_QUESTIONS_PROMPT = (
+    '現在リーンキャンバスをもとに新規事業開発を検討しています。'
+    '開発の概要は以下の通りです。{canvas}'
+    'ここで、{purpose}を確認するため、以下のような人物にインタビューを行いたいと考えています。'
+    '{interviewee}'
+    'およそ1時間のインタビュー時間で、この人物に対して効果的に仮説検証を行うための質問案を、余計な文章を挿入せずに、必ず'
+    '顧客の基本情報: [基本情報に関する質問案の箇条書きリスト], 現在の課題と痛み: [現在の課題と痛みに関する質問案の箇条書きリスト], '
+    '代替手段の利用状況: [代替手段の利用状況に関する質問案の箇条書きリスト], 価値観と意思決定要因: [価値観と意思決定要因に関する質問案の箇条書きリスト]'
+    'のように、JSON形式で回答してください。'
+)
+
 # RAG機能用サービスインスタンス
 file_service = FileService()
 rag_service = RAGService()
@@ -96,20 +232,45 @@ def get_current_user(session_id: str = Cookie(None)) -> int:
 
 # === エンドポイント ===
 
+# 固定の応答本文は起動時に一度だけシリアライズしておく
+_INDEX_BODY = orjson.dumps({"message": "Hello Idea Spark API!"})
+
 @app.get("/")
-def index():
+async def index():
     """ルートエンドポイント"""
-    return {"message": "Hello Idea Spark API!"}
+    return Response(_INDEX_BODY, media_type="application/json")
 
 @app.get("/health")
-def health_check():
+async def health_check():
     """ヘルスチェック"""
-    return {"status": "healthy", "timestamp": datetime.utcnow()}
+    # Responseを直接返し、FastAPIの戻り値変換（jsonable_encoder）を通さない
+    return ORJSONResponse({"status": "healthy", "timestamp": datetime.utcnow()})
+
+@app.get("/debug/pool")
+def debug_pool_status(current_user_id: int = Depends(get_current_user)):
+    """DBコネクションプールの使用状況（プールサイズ調整用）"""
+    return get_pool_status()
+
+# ロードバランサ等からの頻繁なヘルスチェックで毎回DBへ問い合わせないよう、結果を短時間キャッシュする
+_health_cache = TTLCache(maxsize=1, ttl=float(os.getenv("HEALTH_CACHE_TTL_SECONDS", "1")))
+_health_lock = threading.Lock()
+
+def _cached_database_status() -> dict:
+    """DB接続テストの結果を取得（同時に期限切れになった場合もDBへの問い合わせは1回にまとめる）"""
+    db_status = _health_cache.get("database")
+    if db_status is not None:
+        return db_status
+    with _health_lock:
+        db_status = _health_cache.get("database")
+        if db_status is None:
+            db_status = test_database_connection()
+            _health_cache.set("database", db_status)
+        return db_status
 
 @app.get("/health/detailed")
 def detailed_health_check():
     """詳細ヘルスチェック"""
-    db_status = test_database_connection()
+    db_status = _cached_database_status()
     return {
         "status": "healthy" if db_status["status"] == "healthy" else "unhealthy",
         "timestamp": datetime.utcnow(),
@@ -119,9 +280,10 @@ def detailed_health_check():
 @app.post("/api/signup", response_model=AuthResponse)
 def signup(user_data: UserCreate, response: Response, request: Request):
     """ユーザー登録"""
-    # クライアントIP取得
-    client_ip = request.client.host if request.client else "unknown"
-    logger.info(f"Signup attempt from {client_ip} for email: {user_data.email}")
+    # クライアントIPはINFOログを出力する場合だけ取得する
+    if logger.isEnabledFor(logging.INFO):
+        client_ip = request.client.host if request.client else "unknown"
+        logger.info("Signup attempt from %s for email: %s", client_ip, user_data.email)
     
     # ユーザー作成
     result = create_user(user_data.email, user_data.password)
@@ -147,11 +309,11 @@ def signup(user_data: UserCreate, response: Response, request: Request):
     # ユーザー情報取得
     user_info = get_user_by_id(result["user_id"])
     if user_info:
-        user_response = UserResponse(**user_info)
+        user_response = UserResponse.model_construct(**user_info)
     else:
         user_response = None
     
-    return AuthResponse(
+    return AuthResponse.model_construct(
         message="ユーザー登録が完了しました",
         user=user_response
     )
@@ -159,9 +321,10 @@ def signup(user_data: UserCreate, response: Response, request: Request):
 @app.post("/api/login", response_model=AuthResponse)
 def login(user_data: UserLogin, response: Response, request: Request):
     """ユーザーログイン"""
-    # クライアントIP取得
-    client_ip = request.client.host if request.client else "unknown"
-    logger.info(f"Login attempt from {client_ip} for email: {user_data.email}")
+    # クライアントIPはINFOログを出力する場合だけ取得する
+    if logger.isEnabledFor(logging.INFO):
+        client_ip = request.client.host if request.client else "unknown"
+        logger.info("Login attempt from %s for email: %s", client_ip, user_data.email)
     
     # ユーザー認証
     result = authenticate_user(user_data.email, user_data.password)
@@ -187,18 +350,21 @@ def login(user_data: UserLogin, response: Response, request: Request):
     # ユーザー情報取得
     user_info = get_user_by_id(result["user_id"])
     if user_info:
-        user_response = UserResponse(**user_info)
+        user_response = UserResponse.model_construct(**user_info)
     else:
         user_response = None
     
-    return AuthResponse(
+    return AuthResponse.model_construct(
         message="ログインしました",
         user=user_response
     )
 
 @app.post("/api/logout")
-def logout(response: Response):
+def logout(response: Response, session_id: str = Cookie(None)):
     """ログアウト"""
+    # サーバー側のセッションも無効化（キャッシュ済みの検証結果も破棄される）
+    if session_id:
+        invalidate_session(session_id)
     # セッションCookie削除
     response.delete_cookie("session_id")
     return {"message": "ログアウトしました"}
@@ -210,7 +376,8 @@ def get_current_user_info(current_user_id: int = Depends(get_current_user)):
     if not user_info:
         raise HTTPException(status_code=404, detail="ユーザーが見つかりません")
     
-    return UserResponse(**user_info)
+    # DBから取得した値のため、ここでは検証せずに組み立てる（出力はresponse_modelで整形される）
+    return UserResponse.model_construct(**user_info)
 
 @app.get("/api/users/{user_id}")
 def get_user_email(user_id: int):
@@ -220,18 +387,18 @@ def get_user_email(user_id: int):
         raise HTTPException(status_code=404, detail="ユーザーが見つかりません")
     return {"user_id": user_info["user_id"], "email": user_info["email"]}
 
-@app.get("/api/projects", response_model=List[ProjectResponse])
+@app.get("/api/projects", responses={200: {"model": List[ProjectResponse]}})
 def get_projects(current_user_id: int = Depends(get_current_user)):
     """ユーザーのプロジェクト一覧取得"""
-    projects = get_user_projects(current_user_id)
-    return [ProjectResponse(**project) for project in projects]
+    # DBから取得した行はProjectResponseと同じ形のため、response_modelでの再検証をせずorjsonでそのまま返す
+    # （スキーマはドキュメント用にresponsesで指定）
+    return ORJSONResponse(get_user_projects(current_user_id))
 
 @app.get("/projects/{project_id}/latest")
 def get_latest_canvas(project_id: int):
     # response_modelと認証機能は後で実装する
-    edit_id = get_latest_edit_id(project_id)
-    print(f"最新の編集ID: {edit_id}")
-    details = get_canvas_details(edit_id)
+    # 最新のedit_id取得とキャンバス詳細取得を1クエリで行う
+    details = get_latest_canvas_details(project_id)
     return details
 
 @app.post("/projects")
@@ -242,24 +409,20 @@ def register_project(request: ProjectCreateRequest):
         'project_name': request.project_name,
     }
     project_id = insert_project(value)
-    print(f"新規プロジェクト登録: {project_id}")
-    # edit_historyテーブルにデータを挿入、versionは1に設定、edit_idを返却
-    edit_id = insert_edit_history(project_id, version=1, user_id=request.user_id, update_category="manual", update_comment="初回登録")
-    print(f"プロジェクトの編集履歴登録: {edit_id}")
-    # edit_idを使ってdetailテーブルにデータを挿入
-    result = insert_canvas_details(edit_id, request.field)
-    return {"project_id": project_id, "edit_id": edit_id, "result": result}
+    logger.debug("新規プロジェクト登録: %s", project_id)
+    # 編集履歴（version=1）とキャンバス詳細を1トランザクションで登録し、edit_idを返却
+    edit_id = insert_canvas_version(project_id, request.user_id, request.field, update_category="manual", update_comment="初回登録")
+    logger.debug("プロジェクトの編集履歴登録: %s", edit_id)
+    return {"project_id": project_id, "edit_id": edit_id, "result": edit_id is not None}
 
 @app.post("/canvas-autogenerate")
-def auto_generate_canvas(request: ProjectWithAI):
-    request = '今から新規事業開発のリーンキャンバスを作成します。' \
-            'アイデアの概要を以下に提示しますので、リーンキャンバスの各項目を日本語で作成してください。'\
-            '解答には余計な文章を挿入せず、必ず以下の書式を埋める形で回答してください。idea_nameなどのkeyは日本語にせずそのまま返してください：{"idea_name": "", "Problem": "","Customer_Segments": "","Unique_Value_Proposition": "","Solution": "","Channels": "","Revenue_Streams": "","Cost_Structure": "","Key_Metrics": "","Unfair_Advantage": "","Early_Adopters": "","Existing_Alternatives": ""} ## アイデア概要' \
-            + request.idea_draft
-    response = client.chat.completions.create(
+async def auto_generate_canvas(request: ProjectWithAI):
+    # LLMの応答待ちでスレッドプールのワーカーを占有しないよう非同期クライアントを使う
+    prompt = _CANVAS_PROMPT_PREFIX + request.idea_draft
+    response = await async_client.chat.completions.create(
         model='gpt-4o', 
         messages=[
-            {'role': 'user', "content": request},
+            {'role': 'user', "content": prompt},
         ],
     )
     output_content = response.choices[0].message.content.strip()
@@ -269,144 +432,132 @@ def auto_generate_canvas(request: ProjectWithAI):
 @app.post("/projects/{project_id}/latest")
 def update_canvas(request: ProjectUpdateRequest):
     try:
-        version = get_latest_version(request.project_id)
-        if version is None:
-            version = 0  # 初回の場合は0から開始
-        print(f"最新の編集バージョン: {version}")
+        # 最新版+1のバージョンで編集履歴とキャンバス詳細を1トランザクションで登録（update_categoryはリクエストから渡す）
+        edit_id = insert_canvas_version(request.project_id, request.user_id, request.field, update_category=request.update_category, update_comment=request.update_comment)
+        logger.debug("プロジェクトの編集履歴登録: %s", edit_id)
         
-        # update_categoryをリクエストから渡す
-        edit_id = insert_edit_history(request.project_id, version + 1, user_id=request.user_id, update_category=request.update_category, update_comment=request.update_comment)
-        print(f"プロジェクトの編集履歴登録: {edit_id}")
-        
-        if edit_id == 0:
-            raise HTTPException(status_code=500, detail="編集履歴の登録に失敗しました")
-        
-        success = insert_canvas_details(edit_id, request.field)
-        if not success:
-            raise HTTPException(status_code=500, detail="キャンバス詳細の登録に失敗しました")
+        if edit_id is None:
+            raise HTTPException(status_code=500, detail="キャンバスの登録に失敗しました")
         
         return {"success": True, "message": "キャンバスが正常に更新されました"}
         
     except HTTPException:
         raise
     except Exception as e:
-        print(f"キャンバス更新エラー: {e}")
+        logger.error("キャンバス更新エラー: %s", e)
         raise HTTPException(status_code=500, detail=f"キャンバス更新中にエラーが発生しました: {str(e)}")
 
 @app.delete("/projects/{project_id}")
 def delete_canvas(project_id: int, user_id: int = Depends(get_current_user)):
     try:
-        edit_id_list = get_all_edit_ids(project_id, user_id)
-        for edit_id in edit_id_list:
-            remove_detail(edit_id)
-            print("詳細削除")
-
-            research_id = get_research_id(edit_id, user_id)
-            remove_research_result(research_id)
-            print("リサーチ結果削除")
-
-            note_id = get_note_id(edit_id, project_id, user_id)
-            delete_one_note(note_id)
-            print("インタビュー結果削除")
-
-            doc_id = get_doc_id(project_id, user_id)
-            delete_document_record(doc_id, user_id)
-            print("ドキュメント削除")
-
-        # edit_history, members, docs, project削除
-        delete_edit_history(project_id)
-        print("編集履歴削除")
-        delete_members(project_id)
-        print("メンバー削除")
-        delete_project(project_id)
+        # 詳細・リサーチ結果・インタビュー・文書・編集履歴・メンバー・プロジェクトを1トランザクションで削除
+        deleted = delete_project_with_contents(project_id, user_id)
+        if deleted is None:
+            raise HTTPException(status_code=500, detail="キャンバス削除中にエラーが発生しました")
+        if not deleted:
+            raise HTTPException(status_code=404, detail="プロジェクトが見つかりません")
         return {"success": True, "message": "キャンバスが正常に更新されました"}
     except HTTPException:
         raise
     except Exception as e:
-        print(f"キャンバス削除エラー: {e}")
+        logger.error("キャンバス削除エラー: %s", e)
         raise HTTPException(status_code=500, detail=f"キャンバス削除中にエラーが発生しました: {str(e)}")
 
-@app.post("/projects/{project_id}/research")
-async def execute_research(project_id: int, current_user_id: int = Depends(get_current_user)):
-    print(f"=== リサーチAPI開始 ===")
-    print(f"Project ID: {project_id}, User ID: {current_user_id}")
+async def _build_research_document_context(project_id: int, current_canvas: dict) -> str:
+    """キャンバス内容でRAG検索し、リサーチプロンプトに埋め込む関連情報を作成"""
+    # モジュール共通のrag_serviceを使う（呼び出しごとにOpenAIクライアントや検索SQLのキャッシュを作り直さない）
+    # キャンバス内容からRAG検索クエリを構築
+    search_query = f"{current_canvas.get('unique_value_proposition', '')} {current_canvas.get('problem', '')} {current_canvas.get('solution', '')}"
+    logger.debug("RAG検索クエリ: project_id=%s, query=%s", project_id, search_query)
     
+    # アップロードされたドキュメントから関連情報を検索
+    relevant_documents = await rag_service.search_relevant_content(
+        query=search_query,
+        project_id=project_id,
+        limit=5
+    )
+    
+    logger.debug("RAG検索結果数: %d", len(relevant_documents))
+    
+    # RAG結果をコンテキストとして組み込み
+    document_context = ""
+    if relevant_documents:
+        document_context = "\n\n## アップロードされたドキュメントからの関連情報:\n"
+        for i, doc in enumerate(relevant_documents, 1):
+            document_context += f"{i}. ドキュメント名: {doc.get('document_name', 'unknown')}\n"
+            document_context += f"   内容: {doc.get('chunk_text', '')}\n"
+            document_context += f"   類似度: {doc.get('similarity_score', 0):.3f}\n\n"
+    return document_context
+
+
+def _parse_structured_updates(update_proposal: str) -> list:
+    """更新提案テキストからJSONブロックを抽出し、構造化データとしてパース"""
     try:
-        edit_id = get_latest_edit_id(project_id)
-        details = get_canvas_details(edit_id)
-        current_canvas = next(iter(details.values())) # detailsは2重の辞書になっているので、内側だけを取得
-        print(f"Canvas取得完了: {len(current_canvas)} fields")
+        # JSONブロックを抽出
+        json_match = re.search(r'```json\s*(\{.*?\})\s*```', update_proposal, re.DOTALL)
+        if json_match:
+            updates_data = json.loads(json_match.group(1))
+            structured_updates = updates_data.get('updates', [])
+            logger.debug("構造化された更新提案: %d件", len(structured_updates))
+            return structured_updates
+        logger.debug("JSON形式の更新提案が見つかりません")
+    except Exception as e:
+        logger.warning("更新提案のパースエラー: %s", e)
+    return []
 
 
+def _sse_event(event: str, data: dict) -> str:
+    """Server-Sent Events形式の1イベントを作成"""
+    return f"event: {event}\ndata: {orjson.dumps(data).decode()}\n\n"
 
 
-        # RAGサービスを初期化
-        print("RAGサービス初期化中...")
-        rag_service = RAGService()
-        print("RAGサービス初期化完了")
-        
-        # キャンバス内容からRAG検索クエリを構築
-        search_query = f"{current_canvas.get('unique_value_proposition', '')} {current_canvas.get('problem', '')} {current_canvas.get('solution', '')}"
-        print(f"=== RAGデバッグ情報 ===")
-        print(f"Project ID: {project_id}")
-        print(f"Search Query: {search_query}")
-        
-        # アップロードされたドキュメントから関連情報を検索
-        relevant_documents = await rag_service.search_relevant_content(
-            query=search_query,
-            project_id=project_id,
-            limit=5
-        )
-        
-        print(f"RAG検索結果数: {len(relevant_documents)}")
-        if relevant_documents:
-            print(f"最初の結果: {relevant_documents[0]}")
-        else:
-            print("RAG検索結果なし")
-        
-        # RAG結果をコンテキストとして組み込み
-        document_context = ""
-        if relevant_documents:
-            document_context = "\n\n## アップロードされたドキュメントからの関連情報:\n"
-            for i, doc in enumerate(relevant_documents, 1):
-                document_context += f"{i}. ドキュメント名: {doc.get('document_name', 'unknown')}\n"
-                document_context += f"   内容: {doc.get('chunk_text', '')}\n"
-                document_context += f"   類似度: {doc.get('similarity_score', 0):.3f}\n\n"
-            print(f"Document Context: {document_context[:200]}...")
-        else:
-            print("Document Context: なし（RAG結果が空のため）")
-        
-        # リサーチプロンプトを構築（安全な形で）
-        request1 = f'''新規事業開発に関する市場調査を行ってください。以下のビジネス概要に基づいて分析してください。
+def _model_json_response(model: BaseModel) -> Response:
+    """検証済みのレスポンスモデルをpydantic-coreで直接JSONにして返す（response_modelによるdict変換・再検証・再シリアライズを経由しない）
 
-## ビジネス概要
-{str(current_canvas)}
+    modelは通常のコンストラクタ（またはmodel_validate）で作成したものを渡すこと。model_constructで作成したモデルは検証されないまま出力される
+    """
+    return Response(model.model_dump_json(), media_type="application/json")
 
-## 調査項目
-以下の観点で分析してください：
-- 3C分析（市場の成長性・競合状況・顧客ニーズ）
-- 技術調査（必要技術・実現可能性）
-- 法規制事項
 
-## 関連情報
-{document_context if document_context else "追加の関連資料はありません。"}
+def _json_array_response(rows: Iterator[dict]) -> StreamingResponse:
+    """行のイテレータをJSON配列として1行ずつ送信するレスポンスを作成
 
-## 回答形式
-以下の形式で回答してください：
+    最初の1件はここで読み出すため、クエリ開始時のDBエラーは送信前に例外となり呼び出し元で500にできる。
+    送信開始後のエラーはそのまま送出され、配列を閉じずに接続が切れる（正常な途中までの配列と区別できる）
+    """
+    first = next(rows, None)
+    return StreamingResponse(_json_array_stream(first, rows), media_type="application/json")
 
-【市場調査結果】
-1. 市場の成長性
-2. 競合分析
-3. 顧客ニーズ調査
+def _json_array_stream(first: Optional[dict], rows: Iterator[dict]):
+    """先頭の1件と残りの行をJSON配列として1行ずつシリアライズして返す（StreamingResponse用）"""
+    yield b"["
+    if first is not None:
+        yield orjson.dumps(first)
+        for row in rows:
+            yield b"," + orjson.dumps(row)
+    yield b"]"
 
-【技術調査結果】
-1. 必要な技術と要求仕様
-2. 実現可能性
 
-【法規制事項】
-1. 規制'''
+@app.post("/projects/{project_id}/research")
+async def execute_research(project_id: int, current_user_id: int = Depends(get_current_user)):
+    logger.debug("リサーチAPI開始: project_id=%s, user_id=%s", project_id, current_user_id)
+    
+    try:
+        # 最新のedit_idとキャンバスを1クエリで取得（detailsは {edit_id: field} の2重の辞書）
+        details = await run_db(get_latest_canvas_details, project_id)
+        edit_id, current_canvas = next(iter(details.items()))
+        logger.debug("Canvas取得完了: %d fields", len(current_canvas))
+
+        document_context = await _build_research_document_context(project_id, current_canvas)
         
-        response1 = client.chat.completions.create(
+        # リサーチプロンプトを構築（安全な形で）
+        request1 = _RESEARCH_PROMPT1.format(
+            canvas=str(current_canvas),
+            document_context=document_context if document_context else "追加の関連資料はありません。",
+        )
+        
+        # 非同期エンドポイント内のため、同期クライアントでイベントループを止めないよう非同期クライアントで呼び出す
+        response1 = await async_client.chat.completions.create(
             model='gpt-4o', 
             messages=[
                 {'role': 'user', "content": request1},
@@ -414,74 +565,19 @@ async def execute_research(project_id: int, current_user_id: int = Depends(get_c
         )
         output_content1 = response1.choices[0].message.content.strip() # 調査結果のテキスト
         
-        request2 = '''現在リーンキャンバスをもとに新規事業開発を検討しています。
-
-## 現在のリーンキャンバス
-''' + str(current_canvas) + '''
-
-## リサーチ結果
-''' + output_content1 + '''
-
-## 指示
-リサーチ結果を踏まえて、リーンキャンバスの各項目を更新すべき具体的な提案を行ってください。
-以下のJSON形式で、更新が必要な項目のみを含めて回答してください：
-
-```json
-{
-  "updates": [
-    {
-      "field": "キャンバス項目名（英語）",
-      "field_japanese": "キャンバス項目名（日本語）", 
-      "before": "現在の内容",
-      "after": "更新後の内容",
-      "reason": "更新理由の説明"
-    }
-  ]
-}
-```
-
-キャンバス項目名は以下から選択してください：
-- problem（顧客課題）
-- customer_segments（顧客セグメント）
-- unique_value_proposition（独自の価値提案）
-- solution（解決策）
-- channels（販路）
-- revenue_streams（収益の流れ）
-- cost_structure（費用構造）
-- key_metrics（主要指標）
-- unfair_advantage（圧倒的優位性）
-- early_adopters（アーリーアダプター）
-- existing_alternatives（代替品）
-
-更新例は元のリーンキャンバスの文体に合わせ、具体的で実用的な内容にしてください。'''
-        response2 = client.chat.completions.create(
+        request2 = _RESEARCH_PROMPT2.format(canvas=str(current_canvas), research=output_content1)
+        response2 = await async_client.chat.completions.create(
             model='gpt-4o', 
             messages=[
                 {'role': 'user', "content": request2},
             ],
         )
         output_content2 = response2.choices[0].message.content.strip() # 更新提案のテキスト
-        print(f"更新提案: {output_content2}")
 
         # JSON形式の更新提案を構造化データとしてパース
-        structured_updates = []
-        try:
-            import re
-            import json
-            
-            # JSONブロックを抽出
-            json_match = re.search(r'```json\s*(\{.*?\})\s*```', output_content2, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(1)
-                updates_data = json.loads(json_str)
-                structured_updates = updates_data.get('updates', [])
-                print(f"構造化された更新提案: {len(structured_updates)}件")
-            else:
-                print("JSON形式の更新提案が見つかりません")
-        except Exception as e:
-            print(f"更新提案のパースエラー: {e}")
+        structured_updates = _parse_structured_updates(output_content2)
 
-        is_success = insert_research_result(edit_id, current_user_id, output_content1)
+        is_success = await run_db(insert_research_result, edit_id, current_user_id, output_content1)
         return {
             "success": is_success, 
             "research_result": output_content1, 
@@ -491,10 +587,74 @@ async def execute_research(project_id: int, current_user_id: int = Depends(get_c
         }
         
     except Exception as e:
-        logger.error(f"リサーチ実行エラー: {e}")
+        logger.error("リサーチ実行エラー: %s", e)
         raise HTTPException(status_code=500, detail=f"リサーチ実行中にエラーが発生しました: {str(e)}")
 
 
+@app.post("/projects/{project_id}/research/stream")
+async def execute_research_stream(project_id: int, current_user_id: int = Depends(get_current_user)):
+    """リサーチ結果をSSEで逐次返却（調査結果→更新提案の順に送信）"""
+    logger.debug("リサーチストリーミングAPI開始: project_id=%s, user_id=%s", project_id, current_user_id)
+
+    # キャンバス取得の失敗はストリーム開始前に通常のエラーレスポンスとして返す
+    try:
+        # 最新のedit_idとキャンバスを1クエリで取得（detailsは {edit_id: field} の2重の辞書）
+        details = await run_db(get_latest_canvas_details, project_id)
+        edit_id, current_canvas = next(iter(details.items()))
+    except Exception as e:
+        logger.error("リサーチ対象キャンバス取得エラー: %s", e)
+        raise HTTPException(status_code=500, detail=f"リサーチ実行中にエラーが発生しました: {str(e)}")
+
+    async def stream_completion(prompt: str, delta_event: str, parts: list):
+        """GPT応答を差分イベントとして送信し、受信した差分をpartsに蓄積"""
+        stream = await async_client.chat.completions.create(
+            model='gpt-4o',
+            messages=[
+                {'role': 'user', "content": prompt},
+            ],
+            stream=True,
+        )
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                yield _sse_event(delta_event, {"delta": delta})
+
+    async def event_gen():
+        try:
+            document_context = await _build_research_document_context(project_id, current_canvas)
+            request1 = _RESEARCH_PROMPT1.format(
+                canvas=str(current_canvas),
+                document_context=document_context if document_context else "追加の関連資料はありません。",
+            )
+
+            parts1 = []
+            async for event in stream_completion(request1, "research_delta", parts1):
+                yield event
+            output_content1 = "".join(parts1).strip() # 調査結果のテキスト
+            is_success = await run_db(insert_research_result, edit_id, current_user_id, output_content1)
+            yield _sse_event("research", {"success": is_success, "research_result": output_content1})
+
+            request2 = _RESEARCH_PROMPT2.format(canvas=str(current_canvas), research=output_content1)
+            parts2 = []
+            async for event in stream_completion(request2, "update_proposal_delta", parts2):
+                yield event
+            output_content2 = "".join(parts2).strip() # 更新提案のテキスト
+            yield _sse_event("update_proposal", {
+                "update_proposal": output_content2,
+                "canvas_data": current_canvas,
+                "structured_updates": _parse_structured_updates(output_content2),
+            })
+            yield _sse_event("done", {"success": is_success})
+        except Exception as e:
+            logger.error("リサーチストリーミングエラー: %s", e)
+            yield _sse_event("error", {"message": f"リサーチ実行中にエラーが発生しました: {str(e)}"})
+
+    return StreamingResponse(event_gen(), media_type="text/event-stream")
+
+
 @app.delete("/projects/{project_id}/research/{research_id}")
 def delete_one_research(project_id: int, research_id: int):
     result = remove_research_result(research_id)
@@ -504,21 +664,13 @@ def delete_one_research(project_id: int, research_id: int):
 
 
 @app.post("/projects/{project_id}/interview-preparation")
-def interview_preparation(project_id: int, sel: str):
-    edit_id = get_latest_edit_id(project_id)
-    details = get_canvas_details(edit_id)
-    current_canvas = next(iter(details.values())) # detailsは2重の辞書になっているので、内側だけを取得
+def interview_preparation(project_id: int, sel: Literal["CPF", "PSF"]):
+    purpose = _INTERVIEW_PURPOSES[sel]
 
-    if sel == 'CPF':
-        purpose = 'CustomerとProblemの整合性、すなわち想定している顧客が本当にその課題を持っているか、その課題が本当に痛みを伴うものか'
-    elif sel == 'PSF':
-        purpose = 'ProblemとSolutionの整合性、すなわち提案するソリューションが本当にその課題を解決できるか、顧客がそのソリューションを求めるか'
+    details = get_latest_canvas_details(project_id)
+    current_canvas = next(iter(details.values())) # detailsは2重の辞書になっているので、内側だけを取得
 
-    request1 = '現在リーンキャンバスをもとに新規事業開発を検討しています。' \
-            '開発の概要は以下の通りです。' + str(current_canvas) + \
-            'ここで、' + purpose + 'を確認するためのインタビューを行いたいと考えています。' \
-            '理想的なインタビュー対象者を、余計な文章を挿入せずに、必ず ' \
-            '属性: [属性の箇条書きリスト], 特徴: [特徴の箇条書きリスト], 選定基準: [選定基準の箇条書きリスト] のように、JSON形式で回答してください。'
+    request1 = _INTERVIEWEE_PROMPT.format(canvas=str(current_canvas), purpose=purpose)
     response1 = client.chat.completions.create(
         model='gpt-4o', 
         messages=[
@@ -527,14 +679,7 @@ def interview_preparation(project_id: int, sel: str):
     )
     output_content1 = response1.choices[0].message.content.strip() # インタビュイーのテキスト
 
-    request2 = '現在リーンキャンバスをもとに新規事業開発を検討しています。' \
-            '開発の概要は以下の通りです。' + str(current_canvas) + \
-            'ここで、' + purpose + 'を確認するため、以下のような人物にインタビューを行いたいと考えています。' \
-            + str(output_content1) + \
-            'およそ1時間のインタビュー時間で、この人物に対して効果的に仮説検証を行うための質問案を、余計な文章を挿入せずに、必ず' \
-            '顧客の基本情報: [基本情報に関する質問案の箇条書きリスト], 現在の課題と痛み: [現在の課題と痛みに関する質問案の箇条書きリスト], ' \
-            '代替手段の利用状況: [代替手段の利用状況に関する質問案の箇条書きリスト], 価値観と意思決定要因: [価値観と意思決定要因に関する質問案の箇条書きリスト]' \
-            'のように、JSON形式で回答してください。'
+    request2 = _INTERVIEW_QUESTIONS_PROMPT.format(canvas=str(current_canvas), purpose=purpose, interviewee=str(output_content1))
     response2 = client.chat.completions.create(
         model='gpt-4o', 
         messages=[
@@ -546,8 +691,7 @@ def interview_preparation(project_id: int, sel: str):
     return {"interviewee": output_content1, "questions": output_content2}
 
 @app.post("/projects/{project_id}/interview-notes")
-def save_interview_notes(request: InterviewNotesRequest):
-    import traceback
+def save_interview_notes(project_id: int, request: InterviewNotesRequest):
     try:
         # note_idがリクエストに含まれていれば更新、なければ新規作成
         if hasattr(request, 'note_id') and request.note_id:
@@ -556,7 +700,8 @@ def save_interview_notes(request: InterviewNotesRequest):
                 request.interviewee_name,
                 request.interview_date,
                 request.interview_type,
-                request.interview_note
+                request.interview_note,
+                project_id
             )
             if not success:
                 raise HTTPException(status_code=500, detail="インタビューメモの更新に失敗しました")
@@ -567,43 +712,116 @@ def save_interview_notes(request: InterviewNotesRequest):
                 raise HTTPException(status_code=500, detail="インタビューメモの登録に失敗しました")
             return {"success": True, "message": "インタビューメモが正常に登録されました", "note_id": note_id}
     except Exception as e:
-        import logging
-        logging.error(f"save_interview_notesで例外発生: {e}\n{traceback.format_exc()}")
+        logger.exception("save_interview_notesで例外発生: %s", e)
         raise HTTPException(status_code=500, detail=f"サーバーエラー: {str(e)}")
 
 @app.get("/projects/{project_id}/interview-notes")
-def get_interview_notes(project_id: int):
-    result = get_all_interview_notes(project_id)
+def get_interview_notes(
+    project_id: int,
+    limit: Optional[int] = Query(None, ge=1, le=200),
+    before_date: Optional[date] = None,
+    before_created_at: Optional[datetime] = None,
+    interview_type: Optional[InterviewType] = None,
+):
+    # 次ページは前ページ最後のメモの interview_date と created_at の組で指定する
+    if before_created_at is not None and before_date is None:
+        raise HTTPException(status_code=422, detail="before_created_atはbefore_dateと一緒に指定してください")
+    result = get_all_interview_notes(project_id, limit, before_date, interview_type, before_created_at)
     return result
 
 @app.delete("/projects/{project_id}/interview-notes/{note_id}")
 def delete_interview_note(project_id: int, note_id: int):
-    """インタビューメモを削除"""
-    note = get_interview_note_by_id(note_id)
-    if not note:
-        raise HTTPException(status_code=404, detail="インタビューメモが見つかりません")
-    
-    if note["project_id"] != project_id:
-        raise HTTPException(status_code=403, detail="このプロジェクトのインタビューメモではありません")
-    
-    success = delete_one_note(note_id)
+    """インタビューメモを削除（存在・所属プロジェクトの確認は削除と同じDELETE文で行う）"""
+    success = delete_one_note(note_id, project_id)
     if not success:
-        raise HTTPException(status_code=500, detail="インタビューメモの削除に失敗しました")
+        raise HTTPException(status_code=404, detail="このプロジェクトのインタビューメモが見つかりません")
     
     return {"success": True, "message": "インタビューメモが正常に削除されました"}
 
 # === RAG機能用エンドポイント ===
 
-@app.post("/api/projects/{project_id}/upload-and-process")
+async def process_document_for_rag(document_id: int, text_content: str):
+    """RAG処理（テキスト分割・ベクトル化・保存）をバックグラウンドで実行し、処理状況を更新"""
+    await run_db(update_document_processing_status, document_id, 'processing')
+    try:
+        rag_result = await rag_service.process_text_for_rag(
+            document_id=document_id,
+            text_content=text_content
+        )
+    except Exception as e:
+        logger.exception("RAG処理エラー: document_id=%s: %s", document_id, e)
+        rag_result = {"success": False}
+    
+    if not rag_result["success"]:
+        # ドキュメント記録は残す（失敗状態で）
+        logger.error("RAG処理失敗: document_id=%s: %s", document_id, rag_result.get('message', 'Unknown error'))
+    await run_db(update_document_processing_status, document_id, 'completed' if rag_result["success"] else 'failed')
+
+
+# RAG処理の待ち行列。アップロードが集中しても埋め込みAPI・DBへの同時処理数をワーカー数に抑える
+_rag_queue: "asyncio.Queue[tuple]" = asyncio.Queue(maxsize=int(os.getenv("RAG_QUEUE_SIZE", "256")))
+_rag_workers: List[asyncio.Task] = []
+# このプロセスが受け付けて処理が終わっていない document_id（待ち行列内と処理中）。
+# 生存確認時刻の更新と、終了時に残ったものを failed にするために使う
+_rag_owned: Set[int] = set()
+# 生存確認時刻の更新間隔と、更新が途絶えたとみなすまでの秒数
+_RAG_HEARTBEAT_SECONDS = float(os.getenv("RAG_HEARTBEAT_SECONDS", "30"))
+_RAG_STALE_SECONDS = float(os.getenv("RAG_STALE_SECONDS", "300"))
+
+async def _rag_worker():
+    """待ち行列から文書を1件ずつ取り出してRAG処理を行う"""
+    while True:
+        document_id, text_content = await _rag_queue.get()
+        try:
+            await process_document_for_rag(document_id, text_content)
+        except Exception:
+            logger.exception("RAG処理ワーカーで例外発生: document_id=%s", document_id)
+        finally:
+            _rag_owned.discard(document_id)
+            _rag_queue.task_done()
+
+async def _rag_heartbeat():
+    """このプロセスが受け付けたドキュメントの生存確認時刻を定期的に更新する"""
+    while True:
+        await asyncio.sleep(_RAG_HEARTBEAT_SECONDS)
+        await run_db(touch_document_heartbeats, list(_rag_owned))
+
+def _start_rag_workers():
+    """RAG処理ワーカーを起動（アプリケーション起動時）"""
+    for _ in range(int(os.getenv("RAG_WORKERS", "4"))):
+        _rag_workers.append(asyncio.create_task(_rag_worker()))
+    _rag_workers.append(asyncio.create_task(_rag_heartbeat()))
+
+async def _stop_rag_workers():
+    """RAG処理ワーカーを停止（アプリケーション終了時）
+
+    待ち行列の残りを RAG_SHUTDOWN_TIMEOUT_SECONDS 秒まで処理してから停止し、
+    処理しきれなかった文書と中断した文書は failed にする
+    """
+    try:
+        await asyncio.wait_for(_rag_queue.join(), timeout=float(os.getenv("RAG_SHUTDOWN_TIMEOUT_SECONDS", "30")))
+    except asyncio.TimeoutError:
+        logger.warning("RAG処理の待ち行列を処理しきれないまま終了します（残り %s 件）", _rag_queue.qsize())
+    # キャンセルするとワーカー側で処理中の記録が消えるため、先に控えておく
+    # （既に completed / failed になったものは更新されない）
+    unfinished = list(_rag_owned)
+    for task in _rag_workers:
+        task.cancel()
+    await asyncio.gather(*_rag_workers, return_exceptions=True)
+    _rag_workers.clear()
+    await run_db(mark_unfinished_documents_failed, unfinished)
+
+
+@app.post("/api/projects/{project_id}/upload-and-process", status_code=202)
 async def upload_and_process_file(
     project_id: int,
     file: UploadFile = File(...),
     source_type: str = Form(...),
     current_user_id: int = Depends(get_current_user)
 ):
-    """ファイルアップロード→テキスト抽出→RAG処理→元ファイル削除"""
+    """ファイルアップロード→テキスト抽出→元ファイル削除（RAG処理はバックグラウンドで実行）"""
     try:
-        logger.info(f"ファイル処理開始: {file.filename}, プロジェクト: {project_id}")
+        logger.info("ファイル処理開始: %s, プロジェクト: %s", file.filename, project_id)
         
         # 1. ファイル処理とテキスト抽出（一時ファイル使用）
         extraction_result = await file_service.process_uploaded_file_and_extract_text(file)
@@ -612,7 +830,8 @@ async def upload_and_process_file(
             raise HTTPException(status_code=400, detail=extraction_result["message"])
         
         # 2. ドキュメント記録をDBに作成
-        document_id = create_document_record(
+        document_id = await run_db(
+            create_document_record,
             user_id=current_user_id,
             project_id=project_id,
             file_name=extraction_result["file_info"]["original_filename"],
@@ -624,52 +843,34 @@ async def upload_and_process_file(
         if not document_id:
             raise HTTPException(status_code=500, detail="ドキュメント記録の作成に失敗しました")
         
-        # 3. RAG処理（テキスト分割・ベクトル化・保存）
-        rag_result = await rag_service.process_text_for_rag(
-            document_id=document_id,
-            text_content=extraction_result["extracted_text"]
-        )
-        
-        if not rag_result["success"]:
-            logger.error(f"RAG処理失敗: {rag_result.get('message', 'Unknown error')}")
-            # ドキュメント記録は残す（失敗状態で）
-        
-        # 4. 処理状況更新
-        # update_document_processing_status(document_id, 'completed' if rag_result["success"] else 'failed')
+        # 3. RAG処理（テキスト分割・ベクトル化・保存）は待ち行列に入れ、ワーカーが順に実行する
+        # （待ち行列が満杯の場合は空くまで待つ）。処理状況は GET /api/projects/{project_id}/documents/{document_id}/status で確認する
+        _rag_owned.add(document_id)
+        try:
+            await _rag_queue.put((document_id, extraction_result["extracted_text"]))
+        except BaseException:
+            _rag_owned.discard(document_id)
+            raise
         
-        # 処理完了レスポンス
-        logger.info(f"ファイル処理完了: {file.filename}")
+        # 受付完了レスポンス
+        logger.info("ファイル処理完了: %s", file.filename)
         return {
-            "message": "ファイル処理とRAG処理が完了しました",
+            "message": "ファイル処理が完了しました。RAG処理をバックグラウンドで実行しています",
             "document_id": document_id,
+            "processing_status": "pending",
             "file_info": extraction_result["file_info"],
             "text_length": len(extraction_result["extracted_text"]),
             "text_preview": extraction_result["extracted_text"][:200] + "...",
-            "rag_processing": rag_result if 'rag_result' in locals() else {"success": False, "message": "RAG処理がスキップされました"}
+            "rag_processing": {"success": True, "message": "RAG処理をバックグラウンドで開始しました"}
         }
         
+    except HTTPException:
+        raise
+        
     except Exception as e:
-        logger.error(f"ファイル処理エラー: {e}")
+        logger.error("ファイル処理エラー: %s", e)
         raise HTTPException(status_code=500, detail=f"ファイル処理に失敗しました: {str(e)}")
 
-# @app.get("/api/projects/{project_id}/documents")
-# async def get_project_documents_list(
-#     project_id: int,
-#     current_user_id: int = Depends(get_current_user)
-# ):
-#     """プロジェクトのアップロード済み文書一覧取得"""
-#     try:
-#         # documents = get_project_documents(project_id, current_user_id)
-#         # 一時的なレスポンス（データベーススキーマ適用前）
-#         return {
-#             "message": "文書一覧機能は準備中です",
-#             "documents": []
-#         }
-        
-#     except Exception as e:
-#         logger.error(f"文書一覧取得エラー: {e}")
-#         raise HTTPException(status_code=500, detail="文書一覧の取得に失敗しました")
-
 @app.post("/api/projects/{project_id}/search")
 async def search_relevant_content(
     project_id: int,
@@ -678,7 +879,7 @@ async def search_relevant_content(
 ):
     """ベクトル検索でプロジェクト内の関連コンテンツを検索"""
     try:
-        logger.info(f"ベクトル検索開始: プロジェクト{project_id}, クエリ: {search_request.query}")
+        logger.info("ベクトル検索開始: プロジェクト%s, クエリ: %s", project_id, search_request.query)
         
         # RAG検索実行
         search_results = await rag_service.search_relevant_content(
@@ -694,7 +895,7 @@ async def search_relevant_content(
         }
         
     except Exception as e:
-        logger.error(f"ベクトル検索エラー: {e}")
+        logger.error("ベクトル検索エラー: %s", e)
         raise HTTPException(status_code=500, detail="検索に失敗しました")
 
 @app.post("/api/canvas-generate-from-text")
@@ -704,7 +905,7 @@ async def generate_canvas_from_idea(
 ):
     """アイデアテキストからリーンキャンバスを自動生成"""
     try:
-        logger.info(f"キャンバス自動生成開始: {canvas_request.idea_description[:50]}...")
+        logger.info("キャンバス自動生成開始: %s...", canvas_request.idea_description[:50])
         
         # AIによるキャンバス生成
         generation_result = await rag_service.generate_canvas_from_idea(
@@ -723,9 +924,48 @@ async def generate_canvas_from_idea(
         }
         
     except Exception as e:
-        logger.error(f"キャンバス自動生成エラー: {e}")
+        logger.error("キャンバス自動生成エラー: %s", e)
         raise HTTPException(status_code=500, detail="キャンバス生成に失敗しました")
 
+@app.post("/api/canvas-generate-from-text/stream")
+async def generate_canvas_from_idea_stream(
+    canvas_request: CanvasGenerationRequest,
+    current_user_id: int = Depends(get_current_user)
+):
+    """アイデアテキストからリーンキャンバスを自動生成（SSEでGPT応答を逐次返却）"""
+    logger.info("キャンバス自動生成（ストリーミング）開始: %s...", canvas_request.idea_description[:50])
+
+    async def event_gen():
+        async for event in rag_service.stream_canvas_from_idea(
+            idea_description=canvas_request.idea_description,
+            target_audience=canvas_request.target_audience,
+            industry=canvas_request.industry
+        ):
+            if event["type"] == "delta":
+                yield _sse_event("delta", {"delta": event["content"]})
+            elif event["success"]:
+                yield _sse_event("done", {
+                    "message": event["message"],
+                    "canvas_data": event["canvas_data"],
+                    "generated_by": "AI (OpenAI GPT-4o)"
+                })
+            else:
+                yield _sse_event("error", {"message": "キャンバス生成に失敗しました"})
+
+    return StreamingResponse(event_gen(), media_type="text/event-stream")
+
+@app.get("/api/projects/{project_id}/documents/{document_id}/status")
+def get_document_status(
+    project_id: int,
+    document_id: int,
+    current_user_id: int = Depends(get_current_user)
+):
+    """文書のRAG処理状況を取得（pending / processing / completed / failed）"""
+    status = get_document_processing_status(document_id, current_user_id)
+    if not status or status["project_id"] != project_id:
+        raise HTTPException(status_code=404, detail="文書が見つかりません")
+    return status
+
 @app.delete("/api/projects/{project_id}/documents/{document_id}")
 async def delete_document(
     project_id: int,
@@ -734,7 +974,7 @@ async def delete_document(
 ):
     """文書を削除（ベクトルデータも含む）"""
     try:
-        success = delete_document_record(document_id, current_user_id)
+        success = await run_db(delete_document_record, document_id, current_user_id)
         
         if success:
             return {
@@ -745,97 +985,83 @@ async def delete_document(
             raise HTTPException(status_code=404, detail="文書が見つかりません")
         
     except Exception as e:
-        logger.error(f"文書削除エラー: {e}")
+        logger.error("文書削除エラー: %s", e)
         raise HTTPException(status_code=500, detail="文書削除に失敗しました")
 
 
-@app.post("/api/projects/{project_id}/consistency-check", response_model=ConsistencyCheckResponse)
+async def _load_project_canvas(project_id: int, current_user_id: Optional[int] = None,
+                               forbidden_detail: str = "他のユーザーのプロジェクトです"):
+    """LLM系エンドポイント共通の前処理：プロジェクトと最新キャンバスを取得し、存在・権限を確認
+
+    current_user_idを省略した場合は権限チェックを行わない（テスト用エンドポイント向け）
+    """
+    # プロジェクトと最新キャンバスを1クエリで取得
+    result = await run_db(get_project_with_latest_canvas, project_id)
+    
+    # プロジェクトの存在確認とユーザー権限チェック
+    if not result:
+        raise HTTPException(status_code=404, detail="プロジェクトが見つかりません")
+    project, latest_canvas_details = result["project"], result["canvas_details"]
+    
+    if current_user_id is not None and project["user_id"] != current_user_id:
+        raise HTTPException(status_code=403, detail=forbidden_detail)
+    
+    # 最新バージョンのキャンバスデータを確認
+    if not latest_canvas_details:
+        raise HTTPException(status_code=404, detail="プロジェクトのキャンバスデータが見つかりません")
+    
+    return project, latest_canvas_details
+
+async def _run_consistency_check(project_id: int, current_user_id: Optional[int] = None) -> ConsistencyCheckResponse:
+    """整合性確認の本体（認証あり・テスト用の両エンドポイントで共通）"""
+    project, latest_canvas_details = await _load_project_canvas(
+        project_id, current_user_id, "他のユーザーのプロジェクトを確認することはできません"
+    )
+    
+    # 最新のキャンバスデータを使用して整合性分析を実行
+    analysis_result = await consistency_service.analyze_canvas_consistency({
+        "project_name": project["project_name"],
+        "field": latest_canvas_details
+    })
+    
+    if not analysis_result["success"]:
+        raise HTTPException(status_code=500, detail=analysis_result["message"])
+    
+    # LLMの出力を含むため、ここで一度だけ検証する（不正な形式はValidationErrorとして500を返す）
+    return ConsistencyCheckResponse(
+        success=True,
+        analysis=analysis_result["analysis"],
+        analyzed_at=analysis_result["analyzed_at"]
+    )
+
+@app.post("/api/projects/{project_id}/consistency-check", responses={200: {"model": ConsistencyCheckResponse}})
 async def check_canvas_consistency(
     project_id: int,
     current_user_id: int = Depends(get_current_user)
 ):
     """リーンキャンバス整合性確認"""
     try:
-        # プロジェクトの存在確認とユーザー権限チェック
-        project = get_project_by_id(project_id)
-        if not project:
-            raise HTTPException(status_code=404, detail="プロジェクトが見つかりません")
-        
-        if project["user_id"] != current_user_id:
-            raise HTTPException(status_code=403, detail="他のユーザーのプロジェクトを確認することはできません")
-        
-        # 最新バージョンのキャンバスデータを取得
-        latest_edit_id = get_latest_edit_id(project_id)
-        if not latest_edit_id:
-            raise HTTPException(status_code=404, detail="プロジェクトのキャンバスデータが見つかりません")
-        
-        latest_canvas_details = get_canvas_details(latest_edit_id)
-        if not latest_canvas_details:
-            raise HTTPException(status_code=404, detail="キャンバスの詳細データが見つかりません")
-        
-        # 最新のキャンバスデータを使用して整合性分析を実行
-        analysis_result = await consistency_service.analyze_canvas_consistency({
-            "project_name": project["project_name"],
-            "field": latest_canvas_details
-        })
-        
-        if not analysis_result["success"]:
-            raise HTTPException(status_code=500, detail=analysis_result["message"])
-        
-        return ConsistencyCheckResponse(
-            success=True,
-            analysis=analysis_result["analysis"],
-            analyzed_at=analysis_result["analyzed_at"]
-        )
-        
+        return _model_json_response(await _run_consistency_check(project_id, current_user_id))
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"整合性確認エラー: {e}")
+        logger.error("整合性確認エラー: %s", e)
         raise HTTPException(status_code=500, detail="整合性確認の処理に失敗しました")
 
-@app.post("/api/projects/{project_id}/consistency-check/test", response_model=ConsistencyCheckResponse)
+@app.post("/api/projects/{project_id}/consistency-check/test", responses={200: {"model": ConsistencyCheckResponse}})
 async def test_canvas_consistency_check(
     project_id: int
 ):
     """リーンキャンバス整合性確認（テスト用、認証不要）"""
     try:
-        # プロジェクトの存在確認
-        project = get_project_by_id(project_id)
-        if not project:
-            raise HTTPException(status_code=404, detail="プロジェクトが見つかりません")
-        
-        # 最新バージョンのキャンバスデータを取得
-        latest_edit_id = get_latest_edit_id(project_id)
-        if not latest_edit_id:
-            raise HTTPException(status_code=404, detail="プロジェクトのキャンバスデータが見つかりません")
-        
-        latest_canvas_details = get_canvas_details(latest_edit_id)
-        if not latest_canvas_details:
-            raise HTTPException(status_code=404, detail="キャンバスの詳細データが見つかりません")
-        
-        # 最新のキャンバスデータを使用して整合性分析を実行
-        analysis_result = await consistency_service.analyze_canvas_consistency({
-            "project_name": project["project_name"],
-            "field": latest_canvas_details
-        })
-        
-        if not analysis_result["success"]:
-            raise HTTPException(status_code=500, detail=analysis_result["message"])
-        
-        return ConsistencyCheckResponse(
-            success=True,
-            analysis=analysis_result["analysis"],
-            analyzed_at=analysis_result["analyzed_at"]
-        )
-        
+        return _model_json_response(await _run_consistency_check(project_id))
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"整合性確認テストエラー: {e}")
+        logger.error("整合性確認テストエラー: %s", e)
         raise HTTPException(status_code=500, detail="整合性確認の処理に失敗しました")
 
-@app.post("/api/projects/{project_id}/auto-answer", response_model=AutoAnswerGenerationResponse)
+@app.post("/api/projects/{project_id}/auto-answer", responses={200: {"model": AutoAnswerGenerationResponse}})
 async def generate_auto_answers(
     project_id: int,
     request: AutoAnswerGenerationRequest,
@@ -843,22 +1069,9 @@ async def generate_auto_answers(
 ):
     """AI回答自動生成"""
     try:
-        # プロジェクトの存在確認とユーザー権限チェック
-        project = get_project_by_id(project_id)
-        if not project:
-            raise HTTPException(status_code=404, detail="プロジェクトが見つかりません")
-        
-        if project["user_id"] != current_user_id:
-            raise HTTPException(status_code=403, detail="他のユーザーのプロジェクトで回答を生成することはできません")
-        
-        # 最新バージョンのキャンバスデータを取得
-        latest_edit_id = get_latest_edit_id(project_id)
-        if not latest_edit_id:
-            raise HTTPException(status_code=404, detail="プロジェクトのキャンバスデータが見つかりません")
-        
-        latest_canvas_details = get_canvas_details(latest_edit_id)
-        if not latest_canvas_details:
-            raise HTTPException(status_code=404, detail="キャンバスの詳細データが見つかりません")
+        project, latest_canvas_details = await _load_project_canvas(
+            project_id, current_user_id, "他のユーザーのプロジェクトで回答を生成することはできません"
+        )
         
         # AI回答生成を実行
         result = await auto_answer_service.generate_answers(
@@ -870,19 +1083,20 @@ async def generate_auto_answers(
         if not result["success"]:
             raise HTTPException(status_code=500, detail=result["message"])
         
-        return AutoAnswerGenerationResponse(
+        # LLMの出力を含むため、コンストラクタで一度だけ検証してからJSON化する
+        return _model_json_response(AutoAnswerGenerationResponse(
             success=True,
             answers=result["answers"],
             generated_at=result["generated_at"]
-        )
+        ))
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"AI回答生成エラー: {e}")
+        logger.error("AI回答生成エラー: %s", e)
         raise HTTPException(status_code=500, detail="AI回答生成の処理に失敗しました")
 
-@app.post("/api/projects/{project_id}/canvas-update", response_model=CanvasUpdateResponse)
+@app.post("/api/projects/{project_id}/canvas-update", responses={200: {"model": CanvasUpdateResponse}})
 async def generate_canvas_update(
     project_id: int,
     request: CanvasUpdateRequest,
@@ -890,22 +1104,9 @@ async def generate_canvas_update(
 ):
     """リーンキャンバス更新案生成"""
     try:
-        # プロジェクトの存在確認とユーザー権限チェック
-        project = get_project_by_id(project_id)
-        if not project:
-            raise HTTPException(status_code=404, detail="プロジェクトが見つかりません")
-        
-        if project["user_id"] != current_user_id:
-            raise HTTPException(status_code=403, detail="他のユーザーのプロジェクトで更新案を生成することはできません")
-        
-        # 最新バージョンのキャンバスデータを取得
-        latest_edit_id = get_latest_edit_id(project_id)
-        if not latest_edit_id:
-            raise HTTPException(status_code=404, detail="プロジェクトのキャンバスデータが見つかりません")
-        
-        latest_canvas_details = get_canvas_details(latest_edit_id)
-        if not latest_canvas_details:
-            raise HTTPException(status_code=404, detail="キャンバスの詳細データが見つかりません")
+        project, latest_canvas_details = await _load_project_canvas(
+            project_id, current_user_id, "他のユーザーのプロジェクトで更新案を生成することはできません"
+        )
         
         # リーンキャンバス更新案生成を実行
         result = await canvas_update_service.generate_canvas_update(
@@ -917,48 +1118,79 @@ async def generate_canvas_update(
         if not result["success"]:
             raise HTTPException(status_code=500, detail=result["message"])
         
-        return CanvasUpdateResponse(
+        # LLMの出力を含むため、コンストラクタで一度だけ検証してからJSON化する
+        return _model_json_response(CanvasUpdateResponse(
             success=True,
             updated_canvas=result["updated_canvas"],
             generated_at=result["generated_at"]
-        )
+        ))
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"リーンキャンバス更新案生成エラー: {e}")
+        logger.error("リーンキャンバス更新案生成エラー: %s", e)
         raise HTTPException(status_code=500, detail="リーンキャンバス更新案生成の処理に失敗しました")
 
-@app.post("/projects/{project_id}/interview-to-canvas", response_model=InterviewToCanvasResponse)
+@app.post("/api/projects/{project_id}/canvas-update/stream")
+async def generate_canvas_update_stream(
+    project_id: int,
+    request: CanvasUpdateRequest,
+    current_user_id: int = Depends(get_current_user)
+):
+    """リーンキャンバス更新案生成（SSEでGPT応答を逐次返却）"""
+    # 存在・権限エラーはストリーム開始前に通常のエラーレスポンスとして返す
+    project, latest_canvas_details = await _load_project_canvas(
+        project_id, current_user_id, "他のユーザーのプロジェクトで更新案を生成することはできません"
+    )
+
+    async def event_gen():
+        async for event in canvas_update_service.stream_canvas_update(
+            project_name=project["project_name"],
+            canvas_data=latest_canvas_details,
+            user_answers=request.user_answers
+        ):
+            if event["type"] == "delta":
+                yield _sse_event("delta", {"delta": event["content"]})
+            elif event["success"]:
+                yield _sse_event("done", {
+                    "success": True,
+                    "updated_canvas": event["updated_canvas"],
+                    "generated_at": event["generated_at"]
+                })
+            else:
+                yield _sse_event("error", {"message": event["message"]})
+
+    return StreamingResponse(event_gen(), media_type="text/event-stream")
+
+@app.post("/projects/{project_id}/interview-to-canvas", responses={200: {"model": InterviewToCanvasResponse}})
 async def interview_to_canvas(
     project_id: int,
     request: InterviewToCanvasRequest,
     current_user_id: int = Depends(get_current_user)
 ):
-    import traceback
     try:
+        # プロジェクト・インタビューメモ・最新キャンバスは独立しているため並行して取得
+        project, note, latest_canvas_details = await asyncio.gather(
+            run_db(get_project_by_id, project_id),
+            run_db(get_interview_note_by_id, request.note_id),
+            run_db(get_latest_canvas_details, project_id),
+        )
+
         # プロジェクト存在・権限チェック
-        project = get_project_by_id(project_id)
         if not project:
             raise HTTPException(status_code=404, detail="プロジェクトが見つかりません")
         if project["user_id"] != current_user_id:
             raise HTTPException(status_code=403, detail="他のユーザーのプロジェクトです")
 
-        # インタビューメモ取得
-        note = get_interview_note_by_id(request.note_id)
-        logger.info(f"[DEBUG] note: {note}")
+        # インタビューメモ確認
+        logger.debug("note: %s", note)
         if not note:
             raise HTTPException(status_code=404, detail="インタビューメモが見つかりません")
 
-        # 現行キャンバス取得
-        latest_edit_id = get_latest_edit_id(project_id)
-        logger.info(f"[DEBUG] latest_edit_id: {latest_edit_id}")
-        if not latest_edit_id:
-            raise HTTPException(status_code=404, detail="現行キャンバスが見つかりません")
-        latest_canvas_details = get_canvas_details(latest_edit_id)
-        logger.info(f"[DEBUG] latest_canvas_details: {latest_canvas_details}")
+        # 現行キャンバス確認
+        logger.debug("latest_canvas_details: %s", latest_canvas_details)
         if not latest_canvas_details:
-            raise HTTPException(status_code=404, detail="キャンバス詳細が見つかりません")
+            raise HTTPException(status_code=404, detail="現行キャンバスが見つかりません")
 
         # LLM呼び出し用にuser_answers形式へ変換（仮: interview_noteを1件だけ渡す）
         user_answers = [
@@ -968,13 +1200,13 @@ async def interview_to_canvas(
                 "perspective": str(note["interview_type"])
             }
         ]
-        logger.info(f"[DEBUG] user_answers: {user_answers}")
+        logger.debug("user_answers: %s", user_answers)
         result = await canvas_update_service.generate_canvas_update(
             project_name=project["project_name"],
             canvas_data=latest_canvas_details,
             user_answers=user_answers
         )
-        logger.info(f"[DEBUG] canvas_update_service result: {result}")
+        logger.debug("canvas_update_service result: %s", result)
         if not result.get("success"):
             raise HTTPException(status_code=500, detail=result.get("message", "キャンバス更新案生成に失敗しました"))
         proposed_canvas = result.get("updated_canvas") if result else None
@@ -982,27 +1214,19 @@ async def interview_to_canvas(
         current_canvas_field = None
         if latest_canvas_details:
             current_canvas_field = next(iter(latest_canvas_details.values()))
-        return InterviewToCanvasResponse(
+        # LLMの出力を含むため、コンストラクタで一度だけ検証してからJSON化する
+        return _model_json_response(InterviewToCanvasResponse(
             success=True,
             current_canvas=current_canvas_field,
             proposed_canvas=proposed_canvas,
             message="提案キャンバスを生成しました"
-        )
+        ))
     except HTTPException:
         raise
     except Exception as e:
-        import traceback
-        logger.error(f"interview-to-canvasエラー: {e}\n{traceback.format_exc()}")
+        logger.exception("interview-to-canvasエラー: %s", e)
         raise HTTPException(status_code=500, detail=f"サーバーエラー: {str(e)}")
 
-# アプリケーション起動時にテーブル作成
-@app.on_event("startup")
-def startup_event():
-    """アプリケーション起動時の処理"""
-    logger.info("アプリケーションを起動しています...")
-    create_tables()
-    logger.info("アプリケーションの起動が完了しました")
-
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -1010,12 +1234,11 @@ if __name__ == "__main__":
 #アップロード文書表示機能
 @app.get("/projects/{project_id}/documents")
 def get_documents(project_id: int, current_user_id: int = Depends(get_current_user)):
+    # 文書一覧をリストにまとめず、DBから読み出した順にJSON配列として送信する
     try:
-        documents = get_project_documents(project_id)
-        print(f"プロジェクト{project_id}の文書一覧: {len(documents)}件")
-        return documents
+        return _json_array_response(iter_project_documents(project_id, current_user_id))
     except Exception as e:
-        logger.error(f"文書一覧取得エラー: {e}")
+        logger.error("文書一覧取得エラー: %s", e)
         raise HTTPException(status_code=500, detail="文書一覧の取得に失敗しました")
 
 
@@ -1026,17 +1249,16 @@ def get_project_history_list_endpoint(project_id: int):
         history_list = get_project_history_list(project_id)
         return history_list
     except Exception as e:
-        logger.error(f"編集履歴リスト取得エラー: {e}")
+        logger.error("編集履歴リスト取得エラー: %s", e)
         raise HTTPException(status_code=500, detail="編集履歴リストの取得に失敗しました")
 
 @app.get("/projects/{project_id}/research-list")
 def get_project_research_list(project_id: int):
-    """指定プロジェクトのリサーチ履歴リストを返す"""
+    """指定プロジェクトのリサーチ履歴リストを返す（リストにまとめず、読み出した順にJSON配列として送信）"""
     try:
-        research_list = get_project_research_results(project_id)
-        return research_list
+        return _json_array_response(iter_project_research_results(project_id))
     except Exception as e:
-        logger.error(f"リサーチ履歴リスト取得エラー: {e}")
+        logger.error("リサーチ履歴リスト取得エラー: %s", e)
         raise HTTPException(status_code=500, detail="リサーチ履歴リストの取得に失敗しました")
 
 @app.get("/projects/{project_id}/research-result/{research_id}")
@@ -1048,7 +1270,7 @@ def get_research_result(project_id: int, research_id: int):
             raise HTTPException(status_code=404, detail="リサーチ内容が見つかりません")
         return result
     except Exception as e:
-        logger.error(f"リサーチ内容取得エラー: {e}")
+        logger.error("リサーチ内容取得エラー: %s", e)
         raise HTTPException(status_code=500, detail="リサーチ内容の取得に失敗しました")
 
 @app.get("/projects/{project_id}/{version}")
@@ -1069,19 +1291,10 @@ def delete_document_endpoint(
     current_user_id: int = Depends(get_current_user)
 ):
     """文書を削除"""
-    # 文書取得（権限チェック付き）
-    document = get_document_by_id(document_id, current_user_id)
-    if not document:
-        raise HTTPException(status_code=404, detail="文書が見つからないか、削除権限がありません")
-    
-    # プロジェクトID整合性チェック
-    if document["project_id"] != project_id:
-        raise HTTPException(status_code=403, detail="このプロジェクトの文書ではありません")
-    
-    # 削除実行
-    success = delete_documents_record(document_id, current_user_id)
+    # 権限・プロジェクトの確認と削除を1文で実行（確認と削除の間に状態が変わらない）
+    success = delete_documents_record(document_id, current_user_id, project_id)
     if not success:
-        raise HTTPException(status_code=500, detail="文書の削除に失敗しました")
+        raise HTTPException(status_code=404, detail="文書が見つからないか、削除権限がありません")
     
     return {
         "success": True, 
@@ -14,6 +14,8 @@ class AutoAnswerService:
         self.api_key = os.getenv("API_KEY")
         openai.api_key = self.api_key
         self.model = os.getenv("OPENAI_MODEL", "gpt-4-turbo-preview")
+        # イベントループをブロックしない非同期クライアント（接続を使い回すため1度だけ生成）
+        self.client = openai.AsyncOpenAI(api_key=self.api_key)
     
     async def generate_answers(self, project_name: str, questions: List[Dict[str, Any]], canvas_data: Dict[str, Any]) -> Dict[str, Any]:
         """質問に対するAI回答を生成"""
@@ -63,22 +65,17 @@ class AutoAnswerService:
         
         # 各項目の内容を追加
         if canvas_field:
-            for key, value in canvas_field.items():
-                if value:
-                    prompt += f"- {key}: {value}\n"
+            prompt += "".join(f"- {key}: {value}\n" for key, value in canvas_field.items() if value)
         
         prompt += f"""
 ## 回答すべき質問
 """
         
         # 各質問を追加
-        for i, question_data in enumerate(questions, 1):
-            question_text = question_data.get("question", "")
-            perspective = question_data.get("perspective", "")
-            prompt += f"""
-質問{i}: {question_text}
-分析観点: {perspective}
-"""
+        prompt += "".join(
+            f"\n質問{i}: {question_data.get('question', '')}\n分析観点: {question_data.get('perspective', '')}\n"
+            for i, question_data in enumerate(questions, 1)
+        )
         
         prompt += """
 ## 回答の要件
@@ -113,8 +110,7 @@ class AutoAnswerService:
     async def _call_openai_api(self, prompt: str) -> str:
         """OpenAI APIを呼び出し"""
         try:
-            client = openai.OpenAI(api_key=self.api_key)
-            response = client.chat.completions.create(
+            response = await self.client.chat.completions.create(
                 model=self.model,
                 messages=[
                     {"role": "system", "content": "あなたは新規事業開発の専門家です。リーンキャンバスの分析と改善提案を行います。"},
@@ -0,0 +1,87 @@
+# インメモリキャッシュ（TTL + LRU）
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+_MISSING = object()
+
+
+class TTLCache:
+    """有効期限付きのLRUキャッシュ（プロセス内・スレッドセーフ）"""
+
+    def __init__(self, maxsize: int = 256, ttl: float = 60.0):
+        """
+        Args:
+            maxsize: 保持する最大件数（超えた場合は最も古く使われたものから削除）
+            ttl: 有効期限（秒）。0以下の場合はキャッシュを無効化
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.maxsize > 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """キーに対応する値を取得（期限切れ・未登録の場合はdefault）"""
+        if not self.enabled:
+            return default
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                return default
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """値を登録"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        """キーを削除（未登録でもエラーにしない）"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def pop_where(self, predicate: Callable[[Hashable], bool]) -> None:
+        """条件に一致するキーをまとめて削除"""
+        with self._lock:
+            for key in [k for k in self._data if predicate(k)]:
+                del self._data[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+def prompt_cache_key(*parts: Optional[str]) -> str:
+    """モデル名・プロンプト等からキャッシュキー（SHA256）を作成"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update((part or "").encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+# LLM応答の完全一致キャッシュ（同一プロンプトの再送時にAPI呼び出しを省略）
+llm_response_cache = TTLCache(
+    maxsize=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "256")),
+    ttl=float(os.getenv("LLM_CACHE_TTL_SECONDS", "3600")),
+)
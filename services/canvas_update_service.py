@@ -1,10 +1,12 @@
 # リーンキャンバス更新案生成サービス
 import os
 import openai
-from typing import Dict, Any, List
+from typing import Dict, Any, List, AsyncIterator
 import logging
 from datetime import datetime
 
+from services.cache_service import llm_response_cache, prompt_cache_key
+
 logger = logging.getLogger(__name__)
 
 class CanvasUpdateService:
@@ -14,17 +16,29 @@ class CanvasUpdateService:
         self.api_key = os.getenv("API_KEY")
         openai.api_key = self.api_key
         self.model = os.getenv("OPENAI_MODEL", "gpt-4-turbo-preview")
+        # イベントループをブロックしない非同期クライアント（接続を使い回すため1度だけ生成）
+        self.client = openai.AsyncOpenAI(api_key=self.api_key)
+        self.system_prompt = "あなたは新規事業開発の専門家です。リーンキャンバスの分析と新リーンキャンバスの提案を行います。"
     
     async def generate_canvas_update(self, project_name: str, canvas_data: Dict[str, Any], user_answers: List[Dict[str, Any]]) -> Dict[str, Any]:
         """リーンキャンバスの更新案を生成"""
         try:
             prompt = self._build_canvas_update_prompt(project_name, canvas_data, user_answers)
-            response = await self._call_openai_api(prompt)
-            update_result = self._parse_canvas_update_response(response)
+            # 解析に成功した結果だけをキャッシュする（temperature=0.7の生成結果を使い回すため、
+            # TTL内は同じ入力で再生成しても同じ更新案になる）
+            cache_key = prompt_cache_key(self.model, self.system_prompt, prompt)
+            cached = llm_response_cache.get(cache_key)
+            if cached is None:
+                response = await self._call_openai_api(prompt)
+                updated_canvas = self._parse_canvas_update_response(response)["updated_canvas"]
+                llm_response_cache.set(cache_key, (response, dict(updated_canvas)))
+            else:
+                logger.debug("リーンキャンバス更新案生成: キャッシュヒット")
+                updated_canvas = dict(cached[1])
             
             return {
                 "success": True,
-                "updated_canvas": update_result["updated_canvas"],
+                "updated_canvas": updated_canvas,
                 "generated_at": datetime.now().isoformat()
             }
             
@@ -35,6 +49,60 @@ class CanvasUpdateService:
                 "message": f"更新案生成に失敗しました: {str(e)}"
             }
     
+    async def stream_canvas_update(self, project_name: str, canvas_data: Dict[str, Any], user_answers: List[Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
+        """リーンキャンバスの更新案を生成し、GPT応答を差分ごとに返す
+
+        {"type": "delta", "content": ...} を受信順に返し、最後に generate_canvas_update と
+        同じ形式の結果を {"type": "result", ...} として返す
+        """
+        try:
+            prompt = self._build_canvas_update_prompt(project_name, canvas_data, user_answers)
+            # 解析に成功した結果だけをキャッシュする（temperature=0.7の生成結果を使い回すため、
+            # TTL内は同じ入力で再生成しても同じ更新案になる）
+            cache_key = prompt_cache_key(self.model, self.system_prompt, prompt)
+            cached = llm_response_cache.get(cache_key)
+            if cached is None:
+                parts = []
+                stream = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=[
+                        {"role": "system", "content": self.system_prompt},
+                        {"role": "user", "content": prompt}
+                    ],
+                    max_tokens=2000,
+                    temperature=0.7,
+                    stream=True
+                )
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        parts.append(delta)
+                        yield {"type": "delta", "content": delta}
+                response = "".join(parts)
+                updated_canvas = self._parse_canvas_update_response(response)["updated_canvas"]
+                llm_response_cache.set(cache_key, (response, dict(updated_canvas)))
+            else:
+                logger.debug("リーンキャンバス更新案生成: キャッシュヒット")
+                response, updated_canvas = cached[0], dict(cached[1])
+                yield {"type": "delta", "content": response}
+            
+            yield {
+                "type": "result",
+                "success": True,
+                "updated_canvas": updated_canvas,
+                "generated_at": datetime.now().isoformat()
+            }
+            
+        except Exception as e:
+            logger.error(f"リーンキャンバス更新案生成エラー: {e}")
+            yield {
+                "type": "result",
+                "success": False,
+                "message": f"更新案生成に失敗しました: {str(e)}"
+            }
+    
     def _build_canvas_update_prompt(self, project_name: str, canvas_data: Dict[str, Any], user_answers: List[Dict[str, Any]]) -> str:
         """リーンキャンバス更新案生成用のプロンプトを構築"""
         
@@ -54,23 +122,16 @@ class CanvasUpdateService:
 """
         
         if canvas_field:
-            for key, value in canvas_field.items():
-                if value:
-                    prompt += f"- {key}: {value}\n"
+            prompt += "".join(f"- {key}: {value}\n" for key, value in canvas_field.items() if value)
         
         prompt += f"""
 ## ユーザーの回答内容
 """
         
-        for i, answer_data in enumerate(user_answers, 1):
-            question = answer_data.get("question", "")
-            answer = answer_data.get("answer", "")
-            perspective = answer_data.get("perspective", "")
-            prompt += f"""
-質問{i}: {question}
-分析観点: {perspective}
-回答: {answer}
-"""
+        prompt += "".join(
+            f"\n質問{i}: {answer_data.get('question', '')}\n分析観点: {answer_data.get('perspective', '')}\n回答: {answer_data.get('answer', '')}\n"
+            for i, answer_data in enumerate(user_answers, 1)
+        )
         
         prompt += """
 ## 更新案生成の手順
@@ -113,12 +174,12 @@ class CanvasUpdateService:
     
     async def _call_openai_api(self, prompt: str) -> str:
         """OpenAI APIを呼び出し"""
+        system_prompt = self.system_prompt
         try:
-            client = openai.OpenAI(api_key=self.api_key)
-            response = client.chat.completions.create(
+            response = await self.client.chat.completions.create(
                 model=self.model,
                 messages=[
-                    {"role": "system", "content": "あなたは新規事業開発の専門家です。リーンキャンバスの分析と新リーンキャンバスの提案を行います。"},
+                    {"role": "system", "content": system_prompt},
                     {"role": "user", "content": prompt}
                 ],
                 max_tokens=2000,
@@ -1,12 +1,42 @@
 # リーンキャンバス整合性確認サービス
+import copy
+import json
 import os
+import re
 import openai
 from typing import Dict, Any, List
 import logging
 from datetime import datetime
 
+from services.cache_service import llm_response_cache, prompt_cache_key
+
 logger = logging.getLogger(__name__)
 
+# JSONを解析できなかった場合に返す基本的な質問
+_FALLBACK_QUESTIONS = {
+    "Q1": {
+        "question": "各項目間の論理的な整合性に問題はありませんか？",
+        "perspective": "顧客課題と解決策の整合性"
+    },
+    "Q2": {
+        "question": "重要な観点や要素が不足していませんか？",
+        "perspective": "顧客セグメントの定義とターゲティング"
+    },
+    "Q3": {
+        "question": "技術的・経営的な実現可能性は適切に評価されていますか？",
+        "perspective": "価値提案と競合優位性"
+    },
+    "Q4": {
+        "question": "競合分析は十分に深く行われていますか？",
+        "perspective": "ビジネスモデルの持続可能性"
+    },
+    "Q5": {
+        "question": "全体的な事業戦略として一貫性がありますか？",
+        "perspective": "主要指標の適切性"
+    }
+}
+
+
 class ConsistencyService:
     """リーンキャンバスの整合性確認と改善提案を行うサービス"""
     
@@ -18,6 +48,9 @@ class ConsistencyService:
         
         openai.api_key = self.api_key
         self.model = os.getenv("OPENAI_MODEL", "gpt-4-turbo-preview")
+        # イベントループをブロックしない非同期クライアント（接続を使い回すため1度だけ生成）
+        self.client = openai.AsyncOpenAI(api_key=self.api_key)
+        self.system_prompt = "あなたは新規事業開発の専門家です。リーンキャンバスの整合性分析と改善提案を行います。"
     
     async def analyze_canvas_consistency(self, canvas_data: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -33,11 +66,24 @@ class ConsistencyService:
             # プロンプトを構築
             prompt = self._build_consistency_analysis_prompt(canvas_data)
             
-            # OpenAI APIを呼び出し
-            response = await self._call_openai_api(prompt)
-            
-            # レスポンスを解析
-            analysis_result = self._parse_consistency_response(response)
+            # 解析に成功した結果だけをキャッシュする（temperature=0.7の生成結果を使い回すため、
+            # TTL内は同じキャンバスで再実行しても同じ分析結果になる）
+            cache_key = prompt_cache_key(self.model, self.system_prompt, prompt)
+            cached = llm_response_cache.get(cache_key)
+            if cached is None:
+                # OpenAI APIを呼び出し
+                response = await self._call_openai_api(prompt)
+                
+                # レスポンスを解析（解析できない応答は既定の質問で代替し、キャッシュしない）
+                try:
+                    analysis_result = self._parse_consistency_response(response)
+                    llm_response_cache.set(cache_key, copy.deepcopy(analysis_result))
+                except json.JSONDecodeError as e:
+                    logger.error(f"JSON解析エラー: {e}")
+                    analysis_result = copy.deepcopy(_FALLBACK_QUESTIONS)
+            else:
+                logger.debug("整合性分析: キャッシュヒット")
+                analysis_result = copy.deepcopy(cached)
             
             return {
                 "success": True,
@@ -77,9 +123,7 @@ class ConsistencyService:
         
         # 各項目の内容を追加
         if canvas_field:
-            for key, value in canvas_field.items():
-                if value:
-                    prompt += f"- {key}: {value}\n"
+            prompt += "".join(f"- {key}: {value}\n" for key, value in canvas_field.items() if value)
         
         prompt += """
 ## 分析の観点
@@ -143,14 +187,14 @@ JSONのみを出力し、説明文は絶対に含めないでください。
     
     async def _call_openai_api(self, prompt: str) -> str:
         """OpenAI APIを呼び出し"""
+        system_prompt = self.system_prompt
         try:
-            client = openai.OpenAI(api_key=self.api_key)
-            response = client.chat.completions.create(
+            response = await self.client.chat.completions.create(
                 model=self.model,
                 messages=[
                     {
                         "role": "system",
-                        "content": "あなたは新規事業開発の専門家です。リーンキャンバスの整合性分析と改善提案を行います。"
+                        "content": system_prompt
                     },
                     {
                         "role": "user",
@@ -168,43 +212,10 @@ JSONのみを出力し、説明文は絶対に含めないでください。
             raise e
     
     def _parse_consistency_response(self, response: str) -> Dict[str, Dict[str, str]]:
-        """OpenAIのレスポンスを解析してJSONを抽出"""
-        try:
-            # レスポンスからJSON部分を抽出
-            import json
-            import re
-            
-            # JSONパターンを検索
-            json_match = re.search(r'\{.*\}', response, re.DOTALL)
-            if json_match:
-                json_str = json_match.group()
-                return json.loads(json_str)
-            else:
-                # JSONが見つからない場合は、レスポンス全体をパースしてみる
-                return json.loads(response)
-                
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON解析エラー: {e}")
-            # フォールバック: 基本的な質問形式で返す
-            return {
-                "Q1": {
-                    "question": "各項目間の論理的な整合性に問題はありませんか？",
-                    "perspective": "顧客課題と解決策の整合性"
-                },
-                "Q2": {
-                    "question": "重要な観点や要素が不足していませんか？",
-                    "perspective": "顧客セグメントの定義とターゲティング"
-                },
-                "Q3": {
-                    "question": "技術的・経営的な実現可能性は適切に評価されていますか？",
-                    "perspective": "価値提案と競合優位性"
-                },
-                "Q4": {
-                    "question": "競合分析は十分に深く行われていますか？",
-                    "perspective": "ビジネスモデルの持続可能性"
-                },
-                "Q5": {
-                    "question": "全体的な事業戦略として一貫性がありますか？",
-                    "perspective": "主要指標の適切性"
-                }
-            }
+        """OpenAIのレスポンスを解析してJSONを抽出（解析できない場合はjson.JSONDecodeError）"""
+        # JSONパターンを検索
+        json_match = re.search(r'\{.*\}', response, re.DOTALL)
+        if json_match:
+            return json.loads(json_match.group())
+        # JSONが見つからない場合は、レスポンス全体をパースしてみる
+        return json.loads(response)
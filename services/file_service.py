@@ -1,4 +1,5 @@
 # 一時ファイル処理サービス（RAG機能用）
+import asyncio
 import os
 import tempfile
 import magic
@@ -31,6 +32,7 @@ class FileService:
     def __init__(self):
         # 設定値
         self.max_file_size = int(os.getenv("MAX_FILE_SIZE", "52428800"))  # 50MB
+        self.upload_chunk_size = 1024 * 1024  # アップロードを一時ファイルへ書き出す単位（1MB）
         self.allowed_extensions = os.getenv("ALLOWED_FILE_EXTENSIONS", 
                                           "pdf,docx,pptx,xlsx,csv,txt,md,png,jpg,gif").split(",")
         
@@ -67,32 +69,22 @@ class FileService:
         else:
             logger.warning("Tesseract OCRが見つかりません。OCR機能は無効になります。")
     
-    async def validate_file(self, file: UploadFile) -> Dict[str, Any]:
-        """ファイルのバリデーション"""
+    def validate_file(self, file_path: str, filename: str, file_size: int) -> Dict[str, Any]:
+        """一時ファイルに保存済みのアップロードファイルのバリデーション"""
         try:
-            # ファイルサイズチェック
-            file_content = await file.read()
-            file_size = len(file_content)
-            
-            if file_size > self.max_file_size:
-                return {
-                    "valid": False, 
-                    "error": f"ファイルサイズが制限を超えています（制限: {self.max_file_size // 1024 // 1024}MB）"
-                }
-            
             if file_size == 0:
                 return {"valid": False, "error": "空のファイルはアップロードできません"}
             
             # ファイル拡張子チェック
-            file_extension = Path(file.filename).suffix.lower().lstrip('.')
+            file_extension = Path(filename).suffix.lower().lstrip('.')
             if file_extension not in self.allowed_extensions:
                 return {
                     "valid": False, 
                     "error": f"許可されていないファイル形式です（許可形式: {', '.join(self.allowed_extensions)}）"
                 }
             
-            # MIME型チェック
-            mime_type = magic.from_buffer(file_content, mime=True)
+            # MIME型チェック（ファイル先頭のみ読み込まれる）
+            mime_type = magic.from_file(file_path, mime=True)
             if mime_type not in self.mime_mapping:
                 return {"valid": False, "error": "不正なファイル形式です"}
             
@@ -101,9 +93,6 @@ class FileService:
             if file_extension != expected_extension:
                 return {"valid": False, "error": "ファイル拡張子とファイル内容が一致しません"}
             
-            # ファイルをリセット
-            await file.seek(0)
-            
             return {
                 "valid": True,
                 "file_size": file_size,
@@ -115,27 +104,40 @@ class FileService:
             logger.error(f"ファイル検証エラー: {e}")
             return {"valid": False, "error": "ファイル検証中にエラーが発生しました"}
     
+    async def _save_upload_to_temp(self, file: UploadFile, suffix: str) -> Dict[str, Any]:
+        """アップロードファイルを一定サイズずつ一時ファイルへ書き出す（全体をメモリに載せない）"""
+        file_size = 0
+        with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as temp_file:
+            temp_file_path = temp_file.name
+            while chunk := await file.read(self.upload_chunk_size):
+                file_size += len(chunk)
+                if file_size > self.max_file_size:
+                    return {"path": temp_file_path, "file_size": file_size, "too_large": True}
+                temp_file.write(chunk)
+        return {"path": temp_file_path, "file_size": file_size, "too_large": False}
+    
     async def process_uploaded_file_and_extract_text(self, file: UploadFile) -> Dict[str, Any]:
         """アップロードファイルを一時処理してテキスト抽出（元ファイルは削除）"""
         temp_file_path = None
-        print(f"[DEBUG] ファイル処理開始: {file.filename}")
+        logger.debug(f"ファイル処理開始: {file.filename}")
         try:
+            # 一時ファイルに保存（サイズ上限は書き込み中に確認）
+            suffix = Path(file.filename or "").suffix.lower()
+            saved = await self._save_upload_to_temp(file, suffix)
+            temp_file_path = saved["path"]
+            if saved["too_large"]:
+                return {
+                    "success": False,
+                    "message": f"ファイルサイズが制限を超えています（制限: {self.max_file_size // 1024 // 1024}MB）"
+                }
+            
             # ファイルバリデーション
-            validation_result = await self.validate_file(file)
+            validation_result = self.validate_file(temp_file_path, file.filename or "", saved["file_size"])
             if not validation_result["valid"]:
                 return {"success": False, "message": validation_result["error"]}
             
-            # 一時ファイルに保存
-            file_extension = validation_result["extension"]
-            with tempfile.NamedTemporaryFile(
-                suffix=f".{file_extension}", 
-                delete=False
-            ) as temp_file:
-                temp_file_path = temp_file.name
-                content = await file.read()
-                temp_file.write(content)
-            
             # テキスト抽出
+            file_extension = validation_result["extension"]
             extracted_text = await self.extract_text_from_file(temp_file_path, file_extension)
             
             if not extracted_text.strip():
@@ -163,31 +165,37 @@ class FileService:
             return {"success": False, "message": f"ファイル処理に失敗しました: {str(e)}"}
         
         finally:
-            # 一時ファイルを必ず削除
-            if temp_file_path and os.path.exists(temp_file_path):
+            # 一時ファイルを必ず削除（ディスクI/Oでイベントループを止めないよう別スレッドで実行）
+            if temp_file_path:
                 try:
-                    os.remove(temp_file_path)
+                    await asyncio.to_thread(os.remove, temp_file_path)
                     logger.debug(f"一時ファイル削除: {temp_file_path}")
+                except FileNotFoundError:
+                    pass
                 except Exception as cleanup_error:
                     logger.warning(f"一時ファイル削除エラー: {cleanup_error}")
     
     async def extract_text_from_file(self, file_path: str, file_type: str) -> str:
-        """ファイルからテキストを抽出"""
+        """ファイルからテキストを抽出（PDF解析・OCR等はCPUを使う同期処理のため、イベントループを止めないよう別スレッドで実行）"""
+        return await asyncio.to_thread(self._extract_text, file_path, file_type)
+
+    def _extract_text(self, file_path: str, file_type: str) -> str:
+        """ファイル形式に応じた抽出処理を呼び分ける（同期）"""
         try:
             if file_type == "pdf":
-                return await self._extract_from_pdf(file_path)
+                return self._extract_from_pdf(file_path)
             elif file_type == "docx":
-                return await self._extract_from_docx(file_path)
+                return self._extract_from_docx(file_path)
             elif file_type == "pptx":
-                return await self._extract_from_pptx(file_path)  # PowerPoint対応
+                return self._extract_from_pptx(file_path)  # PowerPoint対応
             elif file_type == "xlsx":
-                return await self._extract_from_xlsx(file_path)
+                return self._extract_from_xlsx(file_path)
             elif file_type == "csv":
-                return await self._extract_from_csv(file_path)
+                return self._extract_from_csv(file_path)
             elif file_type in ["txt", "md"]:
-                return await self._extract_from_text(file_path)
+                return self._extract_from_text(file_path)
             elif file_type in ["png", "jpg", "gif"]:
-                return await self._extract_from_image(file_path)
+                return self._extract_from_image(file_path)
             else:
                 return ""
                 
@@ -195,7 +203,7 @@ class FileService:
             logger.error(f"テキスト抽出エラー ({file_type}): {e}")
             return ""
     
-    async def _extract_from_pdf(self, file_path: str) -> str:
+    def _extract_from_pdf(self, file_path: str) -> str:
         """PDFからテキスト抽出（複数ライブラリ + OCR対応）"""
         logger.info(f"PDF分析開始 - ファイル: {file_path}")
         print(f"[DEBUG] PDF分析開始 - ファイル: {file_path}")
@@ -220,7 +228,7 @@ class FileService:
                 logger.info(f"PDF抽出方法: {method_name} を試行中...")
                 print(f"[DEBUG] PDF抽出方法: {method_name} を試行中...")
                 
-                text = await extract_func(file_path)
+                text = extract_func(file_path)
                 
                 if text and len(text.strip()) > 50:  # 十分なテキストが抽出された
                     logger.info(f"PDF抽出成功: {method_name} で {len(text)}文字抽出")
@@ -244,7 +252,7 @@ class FileService:
         logger.error("PDF抽出完全失敗: すべての方法でテキスト抽出に失敗しました")
         return ""
 
-    async def _extract_with_pypdf2(self, file_path: str) -> str:
+    def _extract_with_pypdf2(self, file_path: str) -> str:
         """PyPDF2を使用したPDF抽出"""
         text = ""
         with open(file_path, 'rb') as file:
@@ -266,7 +274,7 @@ class FileService:
         
         return text
     
-    async def _extract_with_pdfplumber(self, file_path: str) -> str:
+    def _extract_with_pdfplumber(self, file_path: str) -> str:
         """pdfplumberを使用したPDF抽出（表やレイアウト対応）"""
         text = ""
         with pdfplumber.open(file_path) as pdf:
@@ -289,7 +297,7 @@ class FileService:
         
         return text
     
-    async def _extract_with_pymupdf(self, file_path: str) -> str:
+    def _extract_with_pymupdf(self, file_path: str) -> str:
         """PyMuPDFを使用したPDF抽出"""
         text = ""
         doc = fitz.open(file_path)
@@ -306,7 +314,7 @@ class FileService:
         doc.close()
         return text
     
-    async def _extract_with_ocr(self, file_path: str) -> str:
+    def _extract_with_ocr(self, file_path: str) -> str:
         """OCRを使用したPDF抽出（画像ベースPDF対応）"""
         try:
             # Tesseractが利用可能か確認
@@ -354,7 +362,7 @@ class FileService:
         doc.close()
         return text
     
-    async def _extract_from_docx(self, file_path: str) -> str:
+    def _extract_from_docx(self, file_path: str) -> str:
         """Wordドキュメントからテキストを抽出"""
         text = ""
         try:
@@ -366,7 +374,7 @@ class FileService:
             logger.error(f"DOCX抽出エラー: {e}")
         return text
     
-    async def _extract_from_pptx(self, file_path: str) -> str:
+    def _extract_from_pptx(self, file_path: str) -> str:
         """PowerPointからテキストを抽出"""
         text = ""
         try:
@@ -381,7 +389,7 @@ class FileService:
             logger.error(f"PPTX抽出エラー: {e}")
         return text
     
-    async def _extract_from_xlsx(self, file_path: str) -> str:
+    def _extract_from_xlsx(self, file_path: str) -> str:
         """Excelファイルからテキストを抽出"""
         text = ""
         try:
@@ -401,7 +409,7 @@ class FileService:
             logger.error(f"XLSX抽出エラー: {e}")
         return text
     
-    async def _extract_from_csv(self, file_path: str) -> str:
+    def _extract_from_csv(self, file_path: str) -> str:
         """CSVファイルからテキストを抽出"""
         text = ""
         try:
@@ -427,7 +435,7 @@ class FileService:
             logger.error(f"CSV抽出エラー: {e}")
         return text
     
-    async def _extract_from_text(self, file_path: str) -> str:
+    def _extract_from_text(self, file_path: str) -> str:
         """テキストファイルからテキストを抽出"""
         text = ""
         try:
@@ -445,7 +453,7 @@ class FileService:
             logger.error(f"テキスト抽出エラー: {e}")
         return text
     
-    async def _extract_from_image(self, file_path: str) -> str:
+    def _extract_from_image(self, file_path: str) -> str:
         """画像ファイルからメタデータを抽出（OCRは今後実装予定）"""
         text = ""
         try:
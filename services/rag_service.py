@@ -1,22 +1,92 @@
 # RAG（Retrieval-Augmented Generation）サービス
+import asyncio
+import functools
 import os
 import openai
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncIterator
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings
 import tiktoken
 import logging
 from datetime import datetime
-import json
-import psycopg2
-from psycopg2.extras import Json
+from types import MappingProxyType
+from psycopg2.extras import Json, execute_values
 
 # 現在のプロジェクト構造に合わせてインポート修正
-from connect_PostgreSQL import SessionLocal
-from sqlalchemy import text
+from connect_PostgreSQL import engine, run_db, json_dumps
+from db_operations import get_embedding_dimensions
+from services.cache_service import TTLCache, llm_response_cache, prompt_cache_key
 
 logger = logging.getLogger(__name__)
 
+@functools.lru_cache(maxsize=8)
+def _vector_format(dimensions: int, significant_digits: int) -> str:
+    """次元数・有効桁数ごとの書式文字列 '[%.Ng,%.Ng,...]' を作成（1回だけ作ってキャッシュ）"""
+    return '[' + ','.join([f"%.{significant_digits}g"] * dimensions) + ']'
+
+def _vector_literal(values: List[float], significant_digits: int) -> str:
+    """pgvectorのテキスト表現 '[x,y,...]' を有効桁数を絞って作成
+
+    str(float)は最大17桁になるため、保存先の精度（vectorはFP32、halfvecはFP16）を超える桁を送らない
+    要素ごとにformat()を呼ばず、1ベクトル分をまとめて%書式で変換する
+    """
+    return _vector_format(len(values), significant_digits) % tuple(values)
+
+
+# 検索クエリの埋め込みキャッシュ（RAGServiceのインスタンス間で共有）
+_query_embedding_cache = TTLCache(
+    maxsize=int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "4096")),
+    ttl=float(os.getenv("QUERY_EMBEDDING_CACHE_TTL_SECONDS", "86400")),
+)
+
+# チャンク保存・ベクトル検索で使う固定SQL（呼び出しごとに文字列を組み立てない）
+_DELETE_CHUNKS_SQL = "DELETE FROM document_chunks WHERE document_id = %s"
+_INSERT_CHUNKS_SQL = (
+    "INSERT INTO document_chunks (document_id, chunk_text, chunk_order, embedding, chunk_metadata) VALUES %s"
+)
+_INSERT_CHUNKS_TEMPLATE = "(%s, %s, %s, %s::vector, %s)"
+_SET_EF_SEARCH_SQL = "SET LOCAL hnsw.ef_search = %s"
+_SET_ITERATIVE_SCAN_SQL = "SET LOCAL hnsw.iterative_scan = relaxed_order"
+_PGVECTOR_VERSION_SQL = "SELECT extversion FROM pg_extension WHERE extname = 'vector'"
+
+# ベクトル検索結果の列名（_vector_search_syncのSELECT列順と対応）
+_SEARCH_RESULT_KEYS = (
+    "chunk_id", "document_id", "document_name", "chunk_text",
+    "similarity_score", "source_type", "project_id", "metadata",
+)
+
+# キャンバス生成応答の見出し（【課題】等）→ キャンバスのキー（呼び出しごとに辞書を作らないよう読み取り専用で共有）
+_CANVAS_FIELD_MAPPING = MappingProxyType({
+    "課題": "problem",
+    "顧客セグメント": "customer_segments",
+    "独自の価値提案": "unique_value_proposition",
+    "ソリューション": "solution",
+    "チャネル": "channels",
+    "収益の流れ": "revenue_streams",
+    "コスト構造": "cost_structure",
+    "主要指標": "key_metrics",
+    "圧倒的優位性": "unfair_advantage",
+    "早期アダプター": "early_adopters",
+    "既存の代替": "existing_alternatives",
+})
+
+# pgvectorがiterative index scan（0.8.0以降）に対応しているか（初回検索時に判定）
+_iterative_scan_supported: Optional[bool] = None
+
+def _supports_iterative_scan(cursor) -> bool:
+    """pgvectorのバージョンを確認し、hnsw.iterative_scanが使えるかを返す"""
+    global _iterative_scan_supported
+    if _iterative_scan_supported is None:
+        try:
+            cursor.execute(_PGVECTOR_VERSION_SQL)
+            row = cursor.fetchone()
+            version = tuple(int(part) for part in row[0].split(".")[:2]) if row else (0, 0)
+            _iterative_scan_supported = version >= (0, 8)
+        except Exception as e:
+            logger.warning("pgvectorバージョン確認エラー: %s", e)
+            _iterative_scan_supported = False
+    return _iterative_scan_supported
+
 class RAGService:
     """RAG関連のビジネスロジック"""
     
@@ -30,6 +100,7 @@ class RAGService:
         
         self.model = os.getenv("OPENAI_MODEL", "gpt-4-turbo-preview")
         self.embedding_model = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-large")
+        self.client = openai.AsyncOpenAI(api_key=self.api_key)
         
         # テキスト分割設定
         self.chunk_size = int(os.getenv("CHUNK_SIZE", "1000"))
@@ -43,9 +114,29 @@ class RAGService:
             separators=["\n\n", "\n", "。", "．", " ", ""]
         )
         
+        # 埋め込み次元数（text-embedding-3系のみ指定可。未設定ならモデル既定値）
+        # 次元を減らすとベクトルの転送量・保存量・距離計算量が減るが、既存チャンクの再処理が必要
+        embedding_dimensions = os.getenv("OPENAI_EMBEDDING_DIMENSIONS")
+        self.embedding_dimensions = int(embedding_dimensions) if embedding_dimensions else None
+        # ベクトル検索で使うhalfvecの次元数（未設定ならモデルの既定値。不明なモデルは起動時にエラー）
+        self.vector_dimensions = get_embedding_dimensions()
+        self.hnsw_ef_search = int(os.getenv("HNSW_EF_SEARCH", "40"))
+        # 2段階検索（バイナリ量子化のハミング距離で候補を絞り、halfvecのコサイン距離で再ランク）
+        # 有効化する場合はcreate_tablesでバイナリ量子化のHNSWインデックスも作成される
+        self.binary_prerank = os.getenv("VECTOR_BINARY_PRERANK", "false").lower() in ("1", "true", "yes")
+        self.prerank_factor = int(os.getenv("VECTOR_PRERANK_FACTOR", "10"))
+        # ベクトル検索SQL（キー: プロジェクト絞り込みの有無）
+        self._vector_search_sql = {
+            filter_by_project: self._build_vector_search_sql(filter_by_project)
+            for filter_by_project in (False, True)
+        }
+        
+        # chunk_size: 1リクエストでまとめて埋め込むテキスト数
         self.embeddings = OpenAIEmbeddings(
             openai_api_key=self.api_key,
-            model=self.embedding_model
+            model=self.embedding_model,
+            dimensions=self.embedding_dimensions,
+            chunk_size=int(os.getenv("EMBEDDING_BATCH_SIZE", "512"))
         )
         
         # トークン計算用エンコーダー
@@ -54,52 +145,53 @@ class RAGService:
     async def process_text_for_rag(self, document_id: int, text_content: str) -> Dict[str, Any]:
         """テキストをRAG用に処理（チャンク化＋ベクトル化）"""
         try:
-            # テキストをチャンクに分割
-            chunks = self.text_splitter.split_text(text_content)
+            # テキストをチャンクに分割（CPU処理のためイベントループを塞がないよう別スレッドで実行）
+            chunks = await asyncio.to_thread(self.text_splitter.split_text, text_content)
             
             if not chunks:
                 return {"success": False, "message": "テキストの分割に失敗しました"}
             
-            # 各チャンクのベクトル埋め込みを生成
-            chunk_data = []
-            for i, chunk_text in enumerate(chunks):
-                try:
-                    # ベクトル埋め込み生成
-                    embedding = await self._get_embedding(chunk_text)
-                    
-                    # メタデータ作成
-                    metadata = {
-                        "chunk_length": len(chunk_text),
-                        "token_count": len(self.encoding.encode(chunk_text)),
-                        "processed_at": datetime.now().isoformat()
-                    }
-                    
-                    chunk_data.append({
-                        "text": chunk_text,
-                        "order": i,
-                        "embedding": embedding,
-                        "metadata": metadata
-                    })
-                    
-                except Exception as e:
-                    logger.error(f"チャンク {i} の処理エラー: {e}")
-                    continue
-            
-            if not chunk_data:
+            # 全チャンクのベクトル埋め込みをバッチで生成（チャンクごとのAPI往復を避ける）
+            try:
+                embeddings = await self.embeddings.aembed_documents(chunks)
+            except Exception as e:
+                logger.error("埋め込み生成エラー: %s", e)
                 return {"success": False, "message": "ベクトル埋め込み生成に失敗しました"}
             
+            # トークン数もまとめて別スレッドで計算
+            token_counts = await asyncio.to_thread(
+                lambda: [len(tokens) for tokens in self.encoding.encode_batch(chunks)]
+            )
+            
+            processed_at = datetime.now().isoformat()
+            chunk_data = []
+            for i, (chunk_text, embedding, token_count) in enumerate(zip(chunks, embeddings, token_counts)):
+                # メタデータ作成
+                metadata = {
+                    "chunk_length": len(chunk_text),
+                    "token_count": token_count,
+                    "processed_at": processed_at
+                }
+                
+                chunk_data.append({
+                    "text": chunk_text,
+                    "order": i,
+                    "embedding": embedding,
+                    "metadata": metadata
+                })
+            
             # データベースに保存
             result = await self._store_document_chunks(document_id, chunk_data)
             
             # 保存結果をチェック
             if not result.get("success", False):
-                logger.error(f"チャンク保存失敗: {result.get('message', 'Unknown error')}")
+                logger.error("チャンク保存失敗: %s", result.get('message', 'Unknown error'))
                 return {
                     "success": False,
                     "message": f"チャンクの保存に失敗しました: {result.get('message', 'Unknown error')}"
                 }
             
-            logger.info(f"ドキュメント処理完了: {document_id}, {len(chunk_data)}チャンク, 保存確認済み")
+            logger.info("ドキュメント処理完了: %s, %sチャンク, 保存確認済み", document_id, len(chunk_data))
             return {
                 "success": True,
                 "chunks_processed": len(chunk_data),
@@ -109,15 +201,19 @@ class RAGService:
             }
             
         except Exception as e:
-            logger.error(f"ドキュメントRAG処理エラー: {e}")
+            logger.error("ドキュメントRAG処理エラー: %s", e)
             return {"success": False, "message": f"RAG処理に失敗しました: {str(e)}"}
     
     async def search_relevant_content(self, query: str, project_id: Optional[int] = None, 
                                     limit: int = 10) -> List[Dict[str, Any]]:
         """関連コンテンツを検索"""
         try:
-            # クエリのベクトル埋め込みを生成
-            query_embedding = await self._get_embedding(query)
+            # クエリのベクトル埋め込みを生成（同じクエリはキャッシュを再利用）
+            cache_key = (self.embedding_model, self.embedding_dimensions, " ".join(query.split()))
+            query_embedding = _query_embedding_cache.get(cache_key)
+            if query_embedding is None:
+                query_embedding = await self._get_embedding(query)
+                _query_embedding_cache.set(cache_key, query_embedding)
             
             # ベクトル検索実行
             search_results = await self._vector_search(
@@ -126,12 +222,13 @@ class RAGService:
                 project_id=project_id
             )
             
-            logger.info(f"ベクトル検索完了: クエリ='{query}', 結果数={len(search_results)}")
+            logger.info("ベクトル検索完了: クエリ='%s', 結果数=%s", query, len(search_results))
             return search_results
             
         except Exception as e:
-            logger.error(f"ベクトル検索エラー: {e}")
-            return []
+            # 空の結果と区別できるよう、エラーは呼び出し元に伝える
+            logger.error("ベクトル検索エラー: %s", e)
+            raise
     
     async def generate_canvas_from_idea(self, idea_description: str, target_audience: Optional[str] = None,
                                       industry: Optional[str] = None) -> Dict[str, Any]:
@@ -141,25 +238,32 @@ class RAGService:
             system_prompt = self._build_canvas_generation_prompt()
             user_prompt = self._build_user_canvas_prompt(idea_description, target_audience, industry)
             
-            # OpenAI APIを呼び出し（新しいAPI形式）
-            from openai import AsyncOpenAI
-            client = AsyncOpenAI(api_key=self.api_key)
-            
-            response = await client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.7,
-                max_tokens=2000
-            )
-            
-            # レスポンスを解析
-            generated_content = response.choices[0].message.content
-            canvas_data = self._parse_canvas_response(generated_content)
+            # 同一プロンプトの生成結果はキャッシュから返す
+            # （temperature=0.7の生成結果を使い回すため、TTL内は同じ入力で再生成しても同じ内容になる）
+            cache_key = prompt_cache_key(self.model, system_prompt, user_prompt)
+            cached = llm_response_cache.get(cache_key)
+            if cached is None:
+                # OpenAI APIを呼び出し（新しいAPI形式）
+                response = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_prompt}
+                    ],
+                    temperature=0.7,
+                    max_tokens=2000
+                )
+                generated_content = response.choices[0].message.content
+                
+                # レスポンスを解析（項目を1つも読み取れなかった応答はキャッシュしない）
+                canvas_data = self._parse_canvas_response(generated_content)
+                if canvas_data:
+                    llm_response_cache.set(cache_key, (generated_content, dict(canvas_data)))
+            else:
+                logger.debug("キャンバス自動生成: キャッシュヒット")
+                generated_content, canvas_data = cached[0], dict(cached[1])
             
-            logger.info(f"キャンバス自動生成完了: アイデア='{idea_description[:50]}...'")
+            logger.info("キャンバス自動生成完了: アイデア='%s...'", idea_description[:50])
             return {
                 "success": True,
                 "canvas_data": canvas_data,
@@ -168,9 +272,66 @@ class RAGService:
             }
             
         except Exception as e:
-            logger.error(f"キャンバス自動生成エラー: {e}")
+            logger.error("キャンバス自動生成エラー: %s", e)
             return {"success": False, "message": f"キャンバス生成に失敗しました: {str(e)}"}
     
+    async def stream_canvas_from_idea(self, idea_description: str, target_audience: Optional[str] = None,
+                                      industry: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """アイデアからリーンキャンバスを生成し、GPT応答を差分ごとに返す
+
+        {"type": "delta", "content": ...} を受信順に返し、最後に generate_canvas_from_idea と
+        同じ形式の結果を {"type": "result", ...} として返す
+        """
+        try:
+            system_prompt = self._build_canvas_generation_prompt()
+            user_prompt = self._build_user_canvas_prompt(idea_description, target_audience, industry)
+            
+            # 同一プロンプトの生成結果はキャッシュから返す
+            # （temperature=0.7の生成結果を使い回すため、TTL内は同じ入力で再生成しても同じ内容になる）
+            cache_key = prompt_cache_key(self.model, system_prompt, user_prompt)
+            cached = llm_response_cache.get(cache_key)
+            if cached is None:
+                parts = []
+                stream = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_prompt}
+                    ],
+                    temperature=0.7,
+                    max_tokens=2000,
+                    stream=True
+                )
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        parts.append(delta)
+                        yield {"type": "delta", "content": delta}
+                generated_content = "".join(parts)
+                
+                # 項目を1つも読み取れなかった応答はキャッシュしない
+                canvas_data = self._parse_canvas_response(generated_content)
+                if canvas_data:
+                    llm_response_cache.set(cache_key, (generated_content, dict(canvas_data)))
+            else:
+                logger.debug("キャンバス自動生成: キャッシュヒット")
+                generated_content, canvas_data = cached[0], dict(cached[1])
+                yield {"type": "delta", "content": generated_content}
+            
+            logger.info("キャンバス自動生成完了: アイデア='%s...'", idea_description[:50])
+            yield {
+                "type": "result",
+                "success": True,
+                "canvas_data": canvas_data,
+                "message": "リーンキャンバスが自動生成されました"
+            }
+            
+        except Exception as e:
+            logger.error("キャンバス自動生成エラー: %s", e)
+            yield {"type": "result", "success": False, "message": f"キャンバス生成に失敗しました: {str(e)}"}
+    
     async def _get_embedding(self, text: str) -> List[float]:
         """テキストのベクトル埋め込みを取得"""
         try:
@@ -178,68 +339,55 @@ class RAGService:
             embedding = await self.embeddings.aembed_query(text)
             return embedding
         except Exception as e:
-            logger.error(f"埋め込み生成エラー: {e}")
+            logger.error("埋め込み生成エラー: %s", e)
             raise
     
-    async def _store_document_chunks(self, document_id: int, chunks: List[Dict[str, Any]]) -> Dict[str, Any]:
-        """ドキュメントのチャンクとベクトルを保存（直接psycopg2を使用）"""
-        logger.info(f"[DEBUG] チャンク保存開始: document_id={document_id}, chunks数={len(chunks)}")
+    async def _store_document_chunks(self, document_id: int, chunks: List[Dict[str, Any]],
+                                     batch_size: int = 500) -> Dict[str, Any]:
+        """ドキュメントのチャンクとベクトルを保存（DB処理は専用スレッドプールで実行）"""
+        return await run_db(self._store_document_chunks_sync, document_id, chunks, batch_size)
+    
+    def _store_document_chunks_sync(self, document_id: int, chunks: List[Dict[str, Any]],
+                                    batch_size: int = 500) -> Dict[str, Any]:
+        """ドキュメントのチャンクとベクトルを保存（直接psycopg2を使用）
+
+        batch_size: 1つのINSERT文にまとめる行数（大きな文書でも文のサイズを抑える）
+        """
+        logger.debug("チャンク保存開始: document_id=%s, chunks数=%s", document_id, len(chunks))
         
-        # SQLAlchemy接続から生のpsycopg2接続を取得
-        db = SessionLocal()
         try:
-            # SQLAlchemyのコネクションから生のpsycopg2コネクションを取得
-            connection = db.get_bind().raw_connection()
+            # エンジンのコネクションプールから生のpsycopg2コネクションを取得（Sessionは作らない）
+            connection = engine.raw_connection()
             cursor = connection.cursor()
             
             try:
                 # 既存のチャンクを削除
-                logger.info(f"[DEBUG] 既存チャンク削除: document_id={document_id}")
-                cursor.execute(
-                    "DELETE FROM document_chunks WHERE document_id = %s",
-                    (document_id,)
-                )
-                logger.info(f"[DEBUG] 削除されたチャンク数: {cursor.rowcount}")
+                cursor.execute(_DELETE_CHUNKS_SQL, (document_id,))
+                logger.debug("削除された既存チャンク数: %s", cursor.rowcount)
                 
-                # 新しいチャンクを挿入
-                logger.info(f"[DEBUG] 新しいチャンク挿入開始")
-                for i, chunk in enumerate(chunks):
-                    logger.info(f"[DEBUG] チャンク {i+1}/{len(chunks)} 処理中: text長={len(chunk['text'])}, order={chunk['order']}, embedding長={len(chunk['embedding'])}")
-                    
-                    try:
-                        # psycopg2でベクトルとJSONBを挿入
-                        cursor.execute(
-                            """
-                            INSERT INTO document_chunks (document_id, chunk_text, chunk_order, embedding, chunk_metadata)
-                            VALUES (%s, %s, %s, %s::vector, %s)
-                            """,
-                            (
-                                document_id,
-                                chunk['text'],
-                                chunk['order'],
-                                chunk['embedding'],  # リストのまま渡す
-                                Json(chunk.get('metadata', {}))  # psycopg2.extras.Json()を使用
-                            )
-                        )
-                        logger.info(f"[DEBUG] チャンク {i+1} 挿入成功: rowcount={cursor.rowcount}")
-                        
-                    except Exception as chunk_error:
-                        logger.error(f"[DEBUG] チャンク {i+1} 挿入エラー: {chunk_error}")
-                        raise chunk_error
+                # 新しいチャンクを一括挿入（1行ずつのINSERTによる往復を避ける）
+                rows = [
+                    (
+                        document_id,
+                        chunk['text'],
+                        chunk['order'],
+                        _vector_literal(chunk['embedding'], 9),  # FP32を損失なく表せる9桁
+                        Json(chunk.get('metadata', {}), dumps=json_dumps)  # orjsonでシリアライズ
+                    )
+                    for chunk in chunks
+                ]
+                execute_values(
+                    cursor,
+                    _INSERT_CHUNKS_SQL,
+                    rows,
+                    template=_INSERT_CHUNKS_TEMPLATE,
+                    page_size=batch_size
+                )
                 
-                # コミット
-                logger.info(f"[DEBUG] 全チャンク挿入完了、コミット実行")
+                # コミット（同一トランザクション内で挿入しているため、件数の再確認は行わない）
                 connection.commit()
                 
-                # 確認クエリ
-                cursor.execute(
-                    "SELECT COUNT(*) FROM document_chunks WHERE document_id = %s",
-                    (document_id,)
-                )
-                actual_count = cursor.fetchone()[0]
-                logger.info(f"[DEBUG] 保存後の確認: document_id={document_id}のチャンク数={actual_count}")
-                
-                logger.info(f"チャンク保存成功: ドキュメント {document_id}, {len(chunks)}チャンク")
+                logger.info("チャンク保存成功: ドキュメント %s, %sチャンク", document_id, len(chunks))
                 return {
                     "success": True,
                     "chunks_stored": len(chunks),
@@ -247,7 +395,7 @@ class RAGService:
                 }
                 
             except Exception as e:
-                logger.error(f"[DEBUG] チャンク保存エラー発生、ロールバック実行")
+                logger.error("チャンク保存エラー発生、ロールバック実行")
                 connection.rollback()
                 raise e
                 
@@ -256,63 +404,112 @@ class RAGService:
                 connection.close()
             
         except Exception as e:
-            logger.error(f"チャンク保存エラー: {type(e).__name__}: {e}")
+            logger.error("チャンク保存エラー: %s: %s", type(e).__name__, e)
             import traceback
-            logger.error(f"エラー詳細: {traceback.format_exc()}")
+            logger.error("エラー詳細: %s", traceback.format_exc())
             return {"success": False, "message": f"チャンク保存に失敗しました: {str(e)}"}
-        finally:
-            db.close()
     
     async def _vector_search(self, query_embedding: List[float], limit: int = 10, 
                           project_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """ベクトル類似検索を実行（DB処理は専用スレッドプールで実行）"""
+        return await run_db(self._vector_search_sync, query_embedding, limit, project_id)
+    
+    def _build_vector_search_sql(self, filter_by_project: bool) -> str:
+        """ベクトル検索SQLを組み立てる（初期化時に絞り込み条件の有無ごとに1回だけ実行）
+
+        上位k件のチャンクを先に確定し、documentsはk件分だけ結合する
+        （距離式はcreate_tablesで作成するHNSW式インデックスと同じ式にする）
+        """
+        dimensions = int(self.vector_dimensions)
+        halfvec_type = f"halfvec({dimensions})"
+        distance_expr = f"(dc.embedding::{halfvec_type} <=> %s::{halfvec_type})"
+        
+        # プロジェクト絞り込み（document_chunks側の条件として評価する）
+        project_filter = ""
+        if filter_by_project:
+            project_filter = """ WHERE EXISTS (
+                SELECT 1 FROM documents pd
+                WHERE pd.document_id = dc.document_id AND pd.project_id = %s
+            )"""
+        
+        if self.binary_prerank:
+            # バイナリ量子化（1次元1bit）のハミング距離で候補を取り、候補だけをコサイン距離で並べ直す
+            bit_type = f"bit({dimensions})"
+            hamming_expr = (
+                f"(binary_quantize(dc.embedding::{halfvec_type})::{bit_type}"
+                f" <~> binary_quantize(%s::{halfvec_type})::{bit_type})"
+            )
+            topk_query = f"""
+                SELECT c.chunk_id, c.document_id, c.chunk_text, c.chunk_metadata,
+                       (c.embedding::{halfvec_type} <=> %s::{halfvec_type}) as distance
+                FROM (
+                    SELECT dc.chunk_id, dc.document_id, dc.chunk_text, dc.chunk_metadata, dc.embedding
+                    FROM document_chunks dc{project_filter}
+                    ORDER BY {hamming_expr} LIMIT %s
+                ) c
+                ORDER BY distance LIMIT %s
+            """
+        else:
+            # 類似度順でソート・制限（インデックスを使えるよう距離式で並べる）
+            topk_query = f"""
+                SELECT dc.chunk_id, dc.document_id, dc.chunk_text, dc.chunk_metadata,
+                       {distance_expr} as distance
+                FROM document_chunks dc{project_filter}
+                ORDER BY {distance_expr} ASC LIMIT %s
+            """
+        
+        # relaxed_orderでは順序がわずかに前後し得るため、結合後に距離で並べ直す
+        # 列順は_SEARCH_RESULT_KEYSと同じにし、類似度スコアへの変換もSQL側で行う
+        return f"""
+            WITH topk AS ({topk_query})
+            SELECT t.chunk_id, t.document_id, d.file_name, t.chunk_text,
+                   1.0 - t.distance, d.source_type, d.project_id,
+                   COALESCE(t.chunk_metadata, '{{}}')
+            FROM topk t
+            JOIN documents d ON d.document_id = t.document_id
+            ORDER BY t.distance
+        """
+    
+    def _vector_search_sync(self, query_embedding: List[float], limit: int = 10, 
+                            project_id: Optional[int] = None) -> List[Dict[str, Any]]:
         """ベクトル類似検索を実行（psycopg2を直接使用）"""
-        db = SessionLocal()
         try:
-            # SQLAlchemy接続から生のpsycopg2接続を取得
-            connection = db.get_bind().raw_connection()
+            # エンジンのコネクションプールから生のpsycopg2コネクションを取得（Sessionは作らない）
+            connection = engine.raw_connection()
             cursor = connection.cursor()
             
             try:
-                # ベースクエリ（pgvectorの正しい構文を使用）
-                base_query = """
-                    SELECT dc.chunk_id, dc.document_id, dc.chunk_text, dc.chunk_metadata,
-                           d.file_name, d.source_type, d.project_id,
-                           (dc.embedding <-> %s::vector) as distance
-                    FROM document_chunks dc
-                    JOIN documents d ON dc.document_id = d.document_id
-                """
+                # 2段階検索ではハミング距離で limit × prerank_factor 件の候補を取る
+                candidate_limit = limit * self.prerank_factor if self.binary_prerank else limit
                 
-                # ベクトルをpostgresのvector表現に変換
-                vector_str = '[' + ','.join(map(str, query_embedding)) + ']'
-                params = [vector_str]
+                # HNSWインデックスの探索幅（上限1000）
+                # ef_searchがLIMITより小さいと返却件数が不足するため、取得件数の2倍を下限にする
+                ef_search = min(max(candidate_limit, limit * 2, self.hnsw_ef_search), 1000)
+                cursor.execute(_SET_EF_SEARCH_SQL, (ef_search,))
                 
-                # プロジェクト絞り込み
-                if project_id is not None:
-                    base_query += " WHERE d.project_id = %s"
-                    params.append(project_id)
+                # プロジェクト絞り込み時、HNSWの候補がフィルタで落ちてLIMIT件数に届かないことがあるため
+                # pgvector 0.8以降ではフィルタ後の件数が揃うまでインデックス探索を継続させる
+                iterative_scan = project_id is not None and _supports_iterative_scan(cursor)
+                if iterative_scan:
+                    cursor.execute(_SET_ITERATIVE_SCAN_SQL)
                 
-                # 類似度順でソート・制限
-                base_query += " ORDER BY distance ASC LIMIT %s"
-                params.append(limit)
+                # ベクトルをpostgresのvector表現に変換（halfvecとして比較するため7桁で十分）
+                vector_str = _vector_literal(query_embedding, 7)
+                
+                # 絞り込み条件の有無ごとに組み立て済みのSQLを使い、パラメータだけを詰める
+                base_query = self._vector_search_sql[project_id is not None]
+                filter_params = (project_id,) if project_id is not None else ()
+                if self.binary_prerank:
+                    params = (vector_str, *filter_params, vector_str, candidate_limit, limit)
+                else:
+                    params = (vector_str, *filter_params, vector_str, limit)
                 
                 cursor.execute(base_query, params)
-                results = cursor.fetchall()
-            
+                
                 # 結果を整形
-                search_results = []
-                for result in results:
-                    search_results.append({
-                        "chunk_id": result[0],
-                        "document_id": result[1],
-                        "document_name": result[4],
-                        "chunk_text": result[2],
-                        "similarity_score": 1.0 - result[7],  # 距離を類似度スコアに変換
-                        "source_type": result[5],
-                        "project_id": result[6],
-                        "metadata": result[3] if result[3] else {}
-                    })
+                search_results = [dict(zip(_SEARCH_RESULT_KEYS, row)) for row in cursor.fetchall()]
                 
-                logger.info(f"ベクトル検索実行: {len(search_results)}件の結果")
+                logger.info("ベクトル検索実行: %s件の結果", len(search_results))
                 return search_results
                 
             finally:
@@ -320,10 +517,8 @@ class RAGService:
                 connection.close()
             
         except Exception as e:
-            logger.error(f"ベクトル検索エラー: {e}")
-            return []
-        finally:
-            db.close()
+            logger.error("ベクトル検索エラー: %s", e)
+            raise
     
     def _build_canvas_generation_prompt(self) -> str:
         """キャンバス生成用のシステムプロンプト"""
@@ -371,19 +566,6 @@ class RAGService:
     def _parse_canvas_response(self, response: str) -> Dict[str, str]:
         """AIレスポンスからキャンバスデータを解析"""
         canvas_data = {}
-        field_mapping = {
-            "課題": "problem",
-            "顧客セグメント": "customer_segments",
-            "独自の価値提案": "unique_value_proposition",
-            "ソリューション": "solution",
-            "チャネル": "channels",
-            "収益の流れ": "revenue_streams",
-            "コスト構造": "cost_structure",
-            "主要指標": "key_metrics",
-            "圧倒的優位性": "unfair_advantage",
-            "早期アダプター": "early_adopters",
-            "既存の代替": "existing_alternatives"
-        }
         
         current_field = None
         current_content = []
@@ -397,7 +579,7 @@ class RAGService:
                 
                 # 新しいフィールド開始
                 field_name = line[1:-1]  # 【】を除去
-                current_field = field_mapping.get(field_name)
+                current_field = _CANVAS_FIELD_MAPPING.get(field_name)
                 current_content = []
             elif current_field and line:
                 current_content.append(line)